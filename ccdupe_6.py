@@ -1,7 +1,41 @@
 import os
 import sys
+import errno
+import gzip
+import json
+import time
+import heapq
+import re
+import struct
+import contextlib
+import itertools
+import socket
+import math
+import mmap
+import ctypes
+import ctypes.util
+import sqlite3
+import csv
+import queue
+import socketserver
+import threading
 import hashlib
-from collections import defaultdict
+import atexit
+import tracemalloc
+import signal
+import stat
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+try:
+    import fcntl  # Only needed for --link=reflink, and not available on Windows
+except ImportError:
+    fcntl = None
+
+try:
+    import resource  # Only needed for the peak RSS in --profile-memory, and not available on Windows
+except ImportError:
+    resource = None
 
 """
 Now that we can identify confirmed duplicates, we will allow the user to interactively delete duplicates by choosing which file to keep.
@@ -14,82 +48,1672 @@ Now that we can identify confirmed duplicates, we will allow the user to interac
 
 """
 
+CHECKPOINT_VERSION = 2
+PREFIX_BYTES = 4096  # Bytes hashed for the prefix digest that splits same-size groups cheaply
+CHANGE_RETRIES = 3  # Times a file that changed while being read is re-queued before it is reported as unstable
+
+# Linux ioctl used for --link=reflink (see linux/fs.h)
+FIDEDUPERANGE = 0xC0189436
+FILE_DEDUPE_RANGE_DIFFERS = 1
+REFLINK_CHUNK = 16 * 1024 * 1024  # Filesystems cap the length of a single dedupe request
+REFLINK_UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOTTY, errno.ENOSYS}  # The whole filesystem says no
+REFLINK_REJECTED = {errno.EINVAL, errno.EXDEV}  # Only this pair: unaligned, overlapping or cross-device
+
+# Cleanup plans written by --plan and read back by 'apply'
+PLAN_VERSION = 1
+PLAN_SAMPLE = 4096  # Bytes read from each end of a file when re-verifying a plan
+
+# Tables written by --db
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY, path TEXT NOT NULL, dir TEXT NOT NULL, root TEXT NOT NULL,
+    size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, digest TEXT
+);
+CREATE TABLE IF NOT EXISTS clusters (
+    id INTEGER PRIMARY KEY, size INTEGER NOT NULL, digest TEXT NOT NULL,
+    members INTEGER NOT NULL, reclaimable_bytes INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cluster_files (cluster_id INTEGER NOT NULL, file_id INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+CREATE INDEX IF NOT EXISTS files_digest ON files (digest);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS clusters_reclaimable ON clusters (reclaimable_bytes);
+CREATE INDEX IF NOT EXISTS cluster_files_cluster ON cluster_files (cluster_id);
+CREATE INDEX IF NOT EXISTS cluster_files_file ON cluster_files (file_id);
+"""
+
+# Ready-made queries for 'query': name -> (title, SQL taking a LIMIT, column headings)
+DB_QUERIES = {
+    "top": ("Largest duplicate clusters", """
+        SELECT reclaimable_bytes, size, members, digest FROM clusters
+        ORDER BY reclaimable_bytes DESC LIMIT ?""",
+        ("reclaimable bytes", "file size", "copies", "digest")),
+    # Each copy carries an equal share of its cluster's waste, so the totals add up across dirs
+    "dirs": ("Directories holding the most duplicate bytes", """
+        SELECT f.dir, SUM(f.size * (c.members - 1) * 1.0 / c.members) AS waste, COUNT(*)
+        FROM cluster_files cf JOIN files f ON f.id = cf.file_id JOIN clusters c ON c.id = cf.cluster_id
+        GROUP BY f.dir ORDER BY waste DESC LIMIT ?""",
+        ("directory", "duplicate bytes", "duplicate files")),
+    "overlap": ("Top-level directories sharing the same content", """
+        SELECT a.root, b.root, COUNT(*), SUM(a.size) FROM
+            (SELECT DISTINCT cf.cluster_id, f.root, c.size FROM cluster_files cf
+             JOIN files f ON f.id = cf.file_id JOIN clusters c ON c.id = cf.cluster_id) a
+        JOIN (SELECT DISTINCT cf.cluster_id, f.root FROM cluster_files cf JOIN files f ON f.id = cf.file_id) b
+            ON a.cluster_id = b.cluster_id AND a.root < b.root
+        GROUP BY a.root, b.root ORDER BY 4 DESC LIMIT ?""",
+        ("root", "other root", "shared clusters", "shared bytes")),
+}
+
+QUARANTINE_JOURNAL = "journal.ndjson"  # Append-only log kept inside the quarantine directory
+QUARANTINE_MARKER = ".ccdupe-quarantine"  # Empty file that tells the walk a directory is a quarantine
+
+# inotify event bits (see linux/inotify.h) used by --watch
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# On-disk Bloom filter written by --bloom: magic, bit count, hash count, entries, then the bits
+BLOOM_MAGIC = b"CCBLOOM1"
+BLOOM_HEADER = "<8sQQQ"
+
+# Shards written by --emit-shard: header, host name, then sorted fixed-size records + path
+SHARD_MAGIC = b"CCSHARD1"
+SHARD_HEADER = "<8sQH"  # magic, record count, host name length
+SHARD_RECORD = "<Q16s16sH"  # size, prefix MD5, full MD5 (zeros when not computed), path length
+
+# Errors worth another try on NFS/SMB: the next attempt often succeeds once the server recovers
+TRANSIENT_ERRORS = {errno.EIO, errno.EAGAIN, getattr(errno, "ESTALE", errno.EIO)}
+
+NO_STAGE = contextlib.nullcontext()  # Stands in for ScanStats.stage() when --stats is off
+TRACE_BUFFER = 1_000_000  # Spans kept by --trace; the oldest are dropped once the ring buffer is full
+
+KEEP_RULES = ("oldest", "newest", "shortest-path")
+
+
+class ScanStats:
+    """ Per-stage wall/CPU time, I/O counters and the candidate funnel of one run (--stats). """
+
+    STAGES = ("scan", "prefix", "hash", "verify")
+
+    def __init__(self):
+        self.wall = dict.fromkeys(self.STAGES, 0.0)
+        self.cpu = dict.fromkeys(self.STAGES, 0.0)
+        self.dirs_walked = 0
+        self.files_read = 0
+        self.bytes_read = 0
+        self.syscalls = 0  # Counted from the I/O pattern (open, fstat, reads, close), not traced
+        self.io_errors = 0
+        # How many files are still in play after each stage
+        self.funnel = {"files": 0, "same_size": 0, "same_prefix": 0, "same_hash": 0, "verified": 0}
+        self.funnel_files = {step: set() for step in self.funnel if step != "files"}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.wall[name] += time.perf_counter() - wall
+            self.cpu[name] += time.process_time() - cpu
+
+    def count_directory(self):
+        self.dirs_walked += 1
+        self.syscalls += 3  # stat, scandir open/getdents, close (entry stats are counted per file)
+
+    def count_read(self, size, reads, files=1):
+        self.files_read += files
+        self.bytes_read += size
+        self.syscalls += reads + 3 * files
+
+    def count_funnel(self, step, files):
+        """ Counts files reaching a funnel step; a group processed again does not count its files twice. """
+        seen = self.funnel_files[step]
+        seen.update(files)
+        self.funnel[step] = len(seen)
+
+    def as_dict(self):
+        """ All counters as plain data, e.g. for json.dumps. """
+        return {
+            "stages": {name: {"wall_seconds": round(self.wall[name], 6), "cpu_seconds": round(self.cpu[name], 6)}
+                       for name in self.STAGES},
+            "dirs_walked": self.dirs_walked,
+            "files_read": self.files_read,
+            "bytes_read": self.bytes_read,
+            "syscalls": self.syscalls + self.funnel["files"],  # Plus one stat per walked file
+            "io_errors": self.io_errors,
+            "funnel": dict(self.funnel),
+        }
+
+    def report(self):
+        """ Prints the --stats summary. """
+        data = self.as_dict()
+        print("\n📊 Stage timings:")
+        for name, stage in data["stages"].items():
+            print(f"  {name:<7} wall {stage['wall_seconds']:9.3f}s   cpu {stage['cpu_seconds']:9.3f}s")
+        print(f"\n📊 I/O: {data['dirs_walked']} directories walked, {data['files_read']} file reads, "
+              f"{data['bytes_read']} bytes read, ~{data['syscalls']} syscalls, {data['io_errors']} errors")
+        print("\n📊 Candidate funnel:")
+        for step, count in data["funnel"].items():
+            print(f"  {step:<12} {count}")
+
+
+class TraceRecorder:
+    """ Records spans from any thread into a ring buffer and writes them as Chrome trace events (--trace). """
+
+    def __init__(self, capacity=TRACE_BUFFER):
+        self.spans = deque(maxlen=capacity)  # append() is atomic, so worker threads need no lock
+        self.recorded = 0
+        self.threads = {}  # (pid, tid) -> thread name, for the trace's metadata events
+        self.origin = time.perf_counter_ns()
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        started = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            key = (os.getpid(), threading.get_ident())
+            if key not in self.threads:
+                self.threads[key] = threading.current_thread().name
+            self.spans.append((name, category, started, time.perf_counter_ns() - started, key, args))
+            self.recorded += 1
+
+    def save(self, trace_file):
+        """ Writes every buffered span in the JSON format Perfetto and chrome://tracing open. """
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": f"ccdupe {pid}"}}
+                  for pid in {pid for pid, _ in self.threads}]
+        events += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                   for (pid, tid), name in self.threads.items()]
+        events += [{"name": name, "cat": category, "ph": "X", "ts": (started - self.origin) / 1000,
+                    "dur": duration / 1000, "pid": pid, "tid": tid, "args": args}
+                   for name, category, started, duration, (pid, tid), args in list(self.spans)]
+
+        dropped = self.recorded - len(self.spans)
+        with open(trace_file, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                       "otherData": {"spans": self.recorded, "dropped": dropped}}, f)
+        print(f"\n🧵 Wrote {len(self.spans)} trace spans to {trace_file}"
+              + (f" ({dropped} oldest dropped)" if dropped else ""))
+
+
+class MemoryProfiler:
+    """ tracemalloc snapshots at stage boundaries plus the size of the finder's big structures (--profile-memory). """
+
+    STRUCTURES = ("size_map", "hash_map", "verified_duplicates")
+
+    def __init__(self, top=5):
+        self.top = top  # Allocation sites listed per snapshot
+        self.snapshots = []  # (label, tracemalloc snapshot, traced bytes, traced peak, peak RSS)
+        tracemalloc.start()
+
+    def snapshot(self, label):
+        """ Records memory as it stands at the end of a stage. """
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        self.snapshots.append((label, snapshot, current, peak, peak_rss()))
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def structure_sizes(self, finder):
+        """ Estimated bytes held by each structure, and per tracked file. """
+        files = max(len(finder.file_stats), 1)
+        seen = set()  # Paths are shared between structures, so each is charged to the first that holds it
+        sizes = {}
+        for name in self.STRUCTURES:
+            total = deep_size(getattr(finder, name), seen)
+            sizes[name] = {"bytes": total, "bytes_per_file": round(total / files, 1)}
+        return sizes
+
+    def as_dict(self, finder):
+        """ Snapshot totals and structure sizes as plain data, e.g. for the benchmark results. """
+        return {
+            "stages": {label: {"traced_bytes": current, "traced_peak_bytes": peak, "peak_rss_bytes": rss}
+                       for label, _, current, peak, rss in self.snapshots},
+            "files": len(finder.file_stats),
+            "structures": self.structure_sizes(finder),
+        }
+
+    def report(self, finder):
+        """ Prints the --profile-memory summary. """
+        print("\n🧠 Memory at each stage boundary (tracemalloc):")
+        previous = None
+        for label, snapshot, current, peak, rss in self.snapshots:
+            rss_text = f"   peak RSS {rss / 2**20:9.1f} MiB" if rss is not None else ""
+            print(f"  {label:<10} traced {current / 2**20:9.1f} MiB   peak {peak / 2**20:9.1f} MiB{rss_text}")
+            if previous is not None:
+                for diff in snapshot.compare_to(previous, "lineno")[:self.top]:
+                    if diff.size_diff > 0:
+                        frame = diff.traceback[0]
+                        print(f"      +{diff.size_diff / 1024:10.1f} KiB  "
+                              f"{os.path.basename(frame.filename)}:{frame.lineno}")
+            previous = snapshot
+
+        print(f"\n🧠 Estimated structure sizes ({len(finder.file_stats)} tracked files):")
+        for name, size in self.structure_sizes(finder).items():
+            print(f"  {name:<20} {size['bytes'] / 2**20:9.1f} MiB   {size['bytes_per_file']:8.1f} bytes/file")
+
+
+class Inotify:
+    """ Minimal ctypes wrapper around Linux inotify, used by --watch. """
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths = {}  # Watch descriptor -> directory
+        self.watches = {}  # Directory -> watch descriptor
+
+    def add_watch(self, folder):
+        """ Starts watching one directory (not recursive: every subdirectory needs its own watch). """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), folder)
+        self.paths[wd] = folder
+        self.watches[folder] = wd
+
+    def forget(self, folder):
+        """ Drops the watches of a directory and everything below it (after it moved away). """
+        prefix = os.path.join(folder, "")
+        for path in [path for path in self.watches if path == folder or path.startswith(prefix)]:
+            wd = self.watches.pop(path)
+            self.paths.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """ Blocks until events arrive and returns them as (mask, path) tuples. """
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from("iIII", data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b"\0")
+            offset += 16 + length
+            folder = self.paths.get(wd)
+            if mask & IN_IGNORED:
+                self.watches.pop(self.paths.pop(wd, None), None)
+            elif folder is not None or mask & IN_Q_OVERFLOW:
+                events.append((mask, os.path.join(folder, os.fsdecode(name)) if name else folder))
+        return events
+
+
+class BloomFilter:
+    """ Memory-mappable Bloom filter over (size, MD5) pairs: "definitely new" or "possibly known". """
+
+    def __init__(self, bits, num_bits, num_hashes, count=0):
+        self.bits = bits  # bytearray while building, read-only mmap after load()
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.count = count
+
+    @classmethod
+    def create(cls, capacity, fp_rate):
+        """ Sizes an empty filter for capacity entries at the requested false-positive rate. """
+        capacity = max(capacity, 1)
+        num_bits = max(8, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(bytearray((num_bits + 7) // 8), num_bits, num_hashes)
+
+    @classmethod
+    def load(cls, path):
+        """ Maps a saved filter straight from disk; pages are only read when a lookup touches them. """
+        with open(path, "rb") as f:
+            bits = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, num_bits, num_hashes, count = struct.unpack_from(BLOOM_HEADER, bits)
+        if magic != BLOOM_MAGIC:
+            raise ValueError(f"{path} is not a ccdupe Bloom filter")
+        return cls(memoryview(bits)[struct.calcsize(BLOOM_HEADER):], num_bits, num_hashes, count)
+
+    def _positions(self, file_size, file_hash):
+        # Double hashing: k positions from two 64-bit halves of one keyed digest
+        key = hashlib.blake2b(file_size.to_bytes(8, "little") + bytes.fromhex(file_hash), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", key)
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, file_size, file_hash):
+        for position in self._positions(file_size, file_hash):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(*item))
+
+    def save(self, path):
+        """ Writes header and bit array atomically. """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(struct.pack(BLOOM_HEADER, BLOOM_MAGIC, self.num_bits, self.num_hashes, self.count))
+            f.write(self.bits)
+        os.replace(tmp_path, path)
+
+
+class ResultWriter:
+    """ Streams confirmed clusters as NDJSON, CSV or JSON from a background thread.
+
+    A cluster streamed earlier can stop holding: a late file (deferred, changed, or seen by --watch)
+    joined or left its hash group. It is then streamed again as a withdrawal record, the same cluster
+    with "withdrawn": true and a negative reclaimable_bytes, so summing that column stays right. The
+    re-verified cluster follows as a new record. """
+
+    def __init__(self, output_format, stream):
+        self.output_format = output_format
+        self.stream = stream
+        self.queue = queue.Queue()
+        self.count = 0
+        self.thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+        self.thread.start()
+
+    def emit(self, file_size, file_hash, files):
+        """ Queues one cluster; never blocks the hashing thread on a slow consumer. """
+        self.queue.put({"size": file_size, "digest": file_hash, "paths": list(files),
+                        "reclaimable_bytes": file_size * (len(files) - 1)})
+
+    def withdraw(self, file_size, file_hash, files):
+        """ Queues the withdrawal of a cluster emitted before that no longer holds as it was. """
+        self.queue.put({"size": file_size, "digest": file_hash, "paths": list(files),
+                        "reclaimable_bytes": -file_size * (len(files) - 1), "withdrawn": True})
+
+    def close(self):
+        """ Writes everything still queued and finishes the document. """
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        if self.output_format == "csv":
+            writer = csv.writer(self.stream)
+            writer.writerow(["cluster", "size", "digest", "reclaimable_bytes", "withdrawn", "path"])
+        elif self.output_format == "json":
+            self.stream.write("[")
+
+        while (cluster := self.queue.get()) is not None:
+            self.count += 1
+            if self.output_format == "csv":
+                writer.writerows([self.count, cluster["size"], cluster["digest"], cluster["reclaimable_bytes"],
+                                  int(cluster.get("withdrawn", False)), path] for path in cluster["paths"])
+            elif self.output_format == "json":
+                self.stream.write(("\n" if self.count == 1 else ",\n") + json.dumps(cluster))
+            else:
+                self.stream.write(json.dumps(cluster) + "\n")
+
+            if self.queue.empty():
+                self.stream.flush()  # Hand results over as soon as the writer catches up
+
+        if self.output_format == "json":
+            self.stream.write("\n]\n")
+        self.stream.flush()
+
+
+class ProgressReporter:
+    """ Prints live progress from a timer thread that only reads the finder's counters (--progress). """
+
+    def __init__(self, finder, interval=None, stream=None):
+        self.finder = finder
+        self.stream = stream or sys.stderr
+        self.tty = self.stream.isatty()
+        # A terminal gets a line redrawn in place; logs get one line per interval
+        self.interval = interval or (1.0 if self.tty else 30.0)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="progress", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """ Stops the timer and leaves the last progress line on screen. """
+        self.stopped.set()
+        self.thread.join()
+        self._print()
+        if self.tty:
+            self.stream.write("\n")
+            self.stream.flush()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self._print()
+
+    def _print(self):
+        line = self.line()
+        if line is None:
+            return
+        if self.tty:
+            self.stream.write(f"\r\033[K{line}")
+        else:
+            self.stream.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {line}\n")
+        self.stream.flush()
+
+    def line(self):
+        """ One line describing the current stage, or None before the first one starts. """
+        finder = self.finder
+        if finder.phase is None:
+            return None
+        elapsed = max(time.monotonic() - finder.phase_started, 1e-9)
+
+        if finder.phase == "scan":
+            files = len(finder.file_stats)
+            return (f"🚶 scan: {files} files walked, {len(finder.frontier)} directories queued, "
+                    f"{files / elapsed:.0f} files/s, {format_duration(elapsed)} elapsed")
+
+        done = finder.candidate_bytes - finder.candidate_bytes_left
+        rate = done / elapsed
+        eta = format_duration(finder.candidate_bytes_left / rate) if rate else "unknown"
+        return (f"🔍 duplicates: {finder.candidates_left} candidates left, "
+                f"{finder.hashed_bytes / 1e6:.1f} MB hashed, {finder.hashed_bytes / 1e6 / elapsed:.1f} MB/s, "
+                f"ETA {eta}")
+
+
+class ReaderLocal(threading.local):
+    given_up = None  # Class default, so threads that are not workers need no lookup fallback
+
+
+class ReadExecutor:
+    """ Runs file reads with retries of transient errors and, with --io-timeout, a per-read deadline. """
+
+    def __init__(self, timeout=None, retries=3, backoff=0.1):
+        self.timeout = timeout  # Seconds a single read may go without progress; None reads in the calling thread
+        self.retries = retries
+        self.backoff = backoff  # First retry delay, doubled on every further attempt
+        self.jobs = None  # Queue of the current worker thread
+        self.given_up = None  # Set once the current worker is abandoned
+        self.abandoned = 0  # Workers left behind in a read that never returned
+        self.reads = 0  # Chunks read so far; a deadline only expires while this stands still
+        self.local = ReaderLocal()  # Each worker's own given_up event
+
+    def beat(self):
+        """ Called by read loops after every chunk: shows progress, and stops an abandoned worker. """
+        given_up = self.local.given_up
+        if given_up is not None and given_up.is_set():
+            raise OSError(errno.ECANCELED, "read abandoned after its deadline")
+        self.reads += 1
+
+    def run(self, func, *args):
+        """ func(*args), retried on EIO/EAGAIN/ESTALE; raises TimeoutError if a deadline is missed. """
+        for attempt in itertools.count():
+            try:
+                return self._run_once(func, args)
+            except TimeoutError:
+                raise  # A hung server will not answer a retry any faster
+            except OSError as e:
+                if e.errno not in TRANSIENT_ERRORS or attempt >= self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def _run_once(self, func, args):
+        if self.timeout is None:
+            return func(*args)
+
+        if self.jobs is None:
+            self.jobs = queue.Queue()
+            self.given_up = threading.Event()
+            # Daemon, so a read stuck in the kernel can never keep the process from exiting
+            threading.Thread(target=self._work, args=(self.jobs, self.given_up), name="reader", daemon=True).start()
+        future = Future()
+        self.jobs.put((future, func, args))
+        seen = self.reads
+        while True:
+            try:
+                return future.result(self.timeout)
+            except FutureTimeoutError:
+                if self.reads != seen:
+                    seen = self.reads  # Slow but still moving: a large file on a healthy server
+                    continue
+            # Leave the stuck worker behind (it stops at its next chunk if the read ever returns)
+            self.given_up.set()
+            self.jobs.put(None)
+            self.jobs = None
+            self.abandoned += 1
+            raise TimeoutError(errno.ETIMEDOUT, f"no progress within {self.timeout:g}s")
+
+    def _work(self, jobs, given_up):
+        self.local.given_up = given_up
+        while (job := jobs.get()) is not None:
+            future, func, args = job
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+class LookupHandler(socketserver.BaseRequestHandler):
+    """ Answers one --serve connection: a request per line, replies in the same order. """
+
+    def handle(self):
+        finder = self.server.finder
+        pending = b""
+        while chunk := self.request.recv(64 * 1024):
+            *lines, pending = (pending + chunk).split(b"\n")
+            if lines:
+                # Everything a pipelining client already sent is answered with a single write
+                self.request.sendall(b"".join(finder.lookup(line) for line in lines if line.strip()))
+
+
 class DuplicateFileFinder:
-    def __init__(self, directory, min_size=0):
+    def __init__(self, directory, min_size=0, checkpoint_file=None, checkpoint_interval=60,
+                 time_budget=None, result_writer=None, stats=None, metrics_file=None, metrics_interval=15,
+                 tracer=None, onerror=None, reader=None):
         self.directory = directory
         self.min_size = min_size  # Ignore files smaller than this size
         self.size_map = defaultdict(list)  # Group files by size
         self.hash_map = defaultdict(list)  # Group files by hash
         self.verified_duplicates = []  # Stores truly identical files
+        self.verified_clusters = []  # (size, md5, [identical files]) for every confirmed cluster
+        self.result_writer = result_writer  # Streams each cluster out as soon as it is confirmed
+        self.streamed = {}  # id(cluster list) -> (size, md5, paths as streamed, cluster list), for withdrawals
+        self.stats = stats  # ScanStats when instrumentation is on, None for zero overhead
+        self.tracer = tracer  # TraceRecorder for --trace, None otherwise
+
+        # File reads go through here for retries and deadlines; files that missed one are retried last
+        self.reader = reader or ReadExecutor()
+        self.deferred = []
+
+        # Entries the walk could not read; counted and sampled instead of aborting the walk
+        self.onerror = onerror  # Called with (path, OSError) for every one, like os.walk's onerror
+        self.walk_errors = defaultdict(int)  # errno name -> count
+        self.error_samples = []  # First few (path, message), for the report
+        self.started = time.monotonic()
+
+        # Prometheus textfile, rewritten every metrics_interval seconds and at the end (needs stats)
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self._last_metrics = time.monotonic()
+
+        # Optional time budget: stop starting new work once the deadline has passed
+        self.deadline = time.monotonic() + time_budget if time_budget is not None else None
+        self.hashed_bytes = 0  # Throughput so far, used to tell whether a group still fits
+        self.hash_seconds = 0.0
+
+        # Where the run is, for ProgressReporter's thread; plain attributes it only ever reads
+        self.phase = None  # "scan" or "duplicates" once started
+        self.phase_started = None
+        self.candidates_left = 0  # Files in size groups not processed yet
+        self.candidate_bytes = 0  # Bytes in all candidate size groups
+        self.candidate_bytes_left = 0
+        self.cancelled = 0  # Number of the signal that asked the run to stop, 0 while it may go on
+
+        # Pipeline state, kept so a long scan can be checkpointed and resumed
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval  # Seconds between checkpoints
+        self.frontier = [directory]  # Directories still waiting to be walked
+        self.walked_dirs = {}  # Directory -> mtime_ns when it was listed
+        self.file_stats = {}  # File -> (size, mtime_ns, ctime_ns) seen during the walk
+        self.changed = {}  # File -> new (size, mtime_ns, ctime_ns) when it changed while being read
+        self.change_attempts = defaultdict(int)
+        self.unstable = []  # Files that kept changing, reported instead of trusted
+        self.file_hashes = {}  # File -> MD5 for every file hashed so far
+        self.verified_hashes = set()  # Hash groups already compared byte by byte
+        self._last_checkpoint = time.monotonic()
 
     def scan_directory(self):
         """ Recursively scans the directory and groups files by size, filtering small files. """
-        try:
-            for root, _, files in os.walk(self.directory):
+        self.phase_started = time.monotonic()
+        self.phase = "scan"
+        with self._stage("scan"):
+            self._walk()
+        self.report_walk_errors()
+
+    def _walk(self):
+        """ Walks the frontier until it is empty (the body of scan_directory). """
+        while self.frontier and not self.cancelled:
+            root = self.frontier.pop()
+            subdirs = []
+            try:
+                self.walked_dirs[root] = os.stat(root).st_mtime_ns
+                with self._span("listdir", "scan", path=root), os.scandir(root) as entries:
+                    for entry in entries:
+                        # One bad entry (vanished, broken link, no permission) must not end the listing
+                        try:
+                            if entry.is_dir():
+                                # Same as os.walk: never follow directory links. Quarantines hold
+                                # copies moved out on purpose, so they are never duplicates again
+                                if not entry.is_symlink() and not self._skip_quarantine(entry.path):
+                                    subdirs.append(entry.path)
+                                continue
+                            self._add_file(entry.path, entry.stat(follow_symlinks=False))
+                        except OSError as e:
+                            self._walk_error(entry.path, e)
+            except OSError as e:
+                self.walked_dirs.pop(root, None)  # Unreadable, so --watch and --resume must not trust it
+                self._walk_error(root, e)
+
+            if self.stats:
+                self.stats.count_directory()
+
+            # Reversed so subdirectories are popped in listing order, like os.walk
+            # (a listing that failed half way still contributes the subdirectories it got to)
+            self.frontier.extend(reversed(subdirs))
+            self._tick()
+
+    def _skip_quarantine(self, path):
+        """ Whether a directory is a quarantine made by quarantine_duplicates; says so for each one skipped. """
+        if not os.path.exists(os.path.join(path, QUARANTINE_MARKER)):
+            return False
+        print(f"📦 Skipping quarantine directory {path}")
+        return True
+
+    def _walk_error(self, path, error):
+        """ Counts an entry the walk could not read and hands it to onerror. """
+        name = errno.errorcode.get(error.errno, type(error).__name__)
+        self.walk_errors[name] += 1
+        if len(self.error_samples) < 5:
+            self.error_samples.append((path, error.strerror or str(error)))
+        if self.onerror:
+            self.onerror(path, error)
+
+    def report_walk_errors(self):
+        """ Prints how many entries were skipped, by error, with a few examples. """
+        if not self.walk_errors:
+            return
+        counts = ", ".join(f"{name} {count}" for name, count in
+                           sorted(self.walk_errors.items(), key=lambda item: -item[1]))
+        print(f"\n⚠️  Skipped {sum(self.walk_errors.values())} unreadable entries ({counts}), e.g.:")
+        for path, message in self.error_samples:
+            print(f"  - {path}: {message}")
+
+    def _add_file(self, file_path, st):
+        """ Records a walked file in size_map unless it is smaller than min_size or not a regular file. """
+        # Ignore files smaller than min_size
+        if st.st_size < self.min_size:
+            return
+        # A symlink would share a cluster with its own target, and cleaning it up could delete the only copy
+        if not stat.S_ISREG(st.st_mode):
+            return
+
+        self.file_stats[file_path] = (st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+        self.size_map[st.st_size].append(file_path)
+        if self.stats:
+            self.stats.funnel["files"] += 1
+
+    def counters(self):
+        """ Where the run is right now, as plain data (dumped on SIGUSR1). """
+        counters = {
+            "phase": self.phase,
+            "elapsed_seconds": round(time.monotonic() - self.started, 3),
+            "files_walked": len(self.file_stats),
+            "directories_queued": len(self.frontier),
+            "files_hashed": len(self.file_hashes),
+            "bytes_hashed": self.hashed_bytes,
+            "candidates_left": self.candidates_left,
+            "candidate_bytes_left": self.candidate_bytes_left,
+            "duplicate_clusters": len(self.verified_clusters),
+            "walk_errors": dict(self.walk_errors),
+            "deferred_files": len(self.deferred),
+            "changed_files": len(self.changed),
+            "unstable_files": len(self.unstable),
+            "abandoned_readers": self.reader.abandoned,
+        }
+        if self.stats:
+            counters["stats"] = self.stats.as_dict()
+        return counters
+
+    def _tick(self):
+        """ Called between units of work: writes checkpoints and metrics when they are due. """
+        self._maybe_checkpoint()
+        if self.metrics_file and time.monotonic() - self._last_metrics >= self.metrics_interval:
+            self.write_metrics()
+
+    def write_metrics(self, complete=False):
+        """ Atomically rewrites the Prometheus textfile with the current run's metrics. """
+        data = self.stats.as_dict()
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        hash_wall = data["stages"]["hash"]["wall_seconds"]
+        funnel = data["funnel"]
+        steps = list(funnel.items())
+
+        lines = [
+            "# HELP ccdupe_stage_duration_seconds Wall time spent in each pipeline stage.",
+            "# TYPE ccdupe_stage_duration_seconds gauge",
+            *(f'ccdupe_stage_duration_seconds{{stage="{name}"}} {stage["wall_seconds"]}'
+              for name, stage in data["stages"].items()),
+            "# HELP ccdupe_stage_cpu_seconds CPU time spent in each pipeline stage.",
+            "# TYPE ccdupe_stage_cpu_seconds gauge",
+            *(f'ccdupe_stage_cpu_seconds{{stage="{name}"}} {stage["cpu_seconds"]}'
+              for name, stage in data["stages"].items()),
+            "# HELP ccdupe_files_scanned Files found by the walk.",
+            "# TYPE ccdupe_files_scanned gauge",
+            f"ccdupe_files_scanned {funnel['files']}",
+            "# HELP ccdupe_files_per_second Files walked per second of run time.",
+            "# TYPE ccdupe_files_per_second gauge",
+            f"ccdupe_files_per_second {funnel['files'] / elapsed:.3f}",
+            "# HELP ccdupe_hash_megabytes_per_second Full-hash throughput.",
+            "# TYPE ccdupe_hash_megabytes_per_second gauge",
+            f"ccdupe_hash_megabytes_per_second {self.hashed_bytes / 1e6 / hash_wall if hash_wall else 0:.3f}",
+            "# HELP ccdupe_candidates_eliminated Files ruled out by each stage of the funnel.",
+            "# TYPE ccdupe_candidates_eliminated gauge",
+            *(f'ccdupe_candidates_eliminated{{stage="{step}"}} {max(previous - count, 0)}'
+              for (_, previous), (step, count) in zip(steps, steps[1:])),
+            "# HELP ccdupe_bytes_read Bytes read while hashing and verifying.",
+            "# TYPE ccdupe_bytes_read gauge",
+            f"ccdupe_bytes_read {data['bytes_read']}",
+            "# HELP ccdupe_duplicate_clusters Confirmed clusters of identical files.",
+            "# TYPE ccdupe_duplicate_clusters gauge",
+            f"ccdupe_duplicate_clusters {len(self.verified_clusters)}",
+            "# HELP ccdupe_duplicate_bytes Bytes that removing the duplicates would free.",
+            "# TYPE ccdupe_duplicate_bytes gauge",
+            f"ccdupe_duplicate_bytes {sum(size * (len(files) - 1) for size, _, files in self.verified_clusters)}",
+            "# HELP ccdupe_io_errors I/O errors while reading files.",
+            "# TYPE ccdupe_io_errors gauge",
+            f"ccdupe_io_errors {data['io_errors']}",
+            "# HELP ccdupe_walk_errors Entries the walk skipped because they could not be read.",
+            "# TYPE ccdupe_walk_errors gauge",
+            *(f'ccdupe_walk_errors{{error="{name}"}} {count}' for name, count in self.walk_errors.items()),
+            "# HELP ccdupe_run_complete 1 once the run has finished, 0 while it is in progress.",
+            "# TYPE ccdupe_run_complete gauge",
+            f"ccdupe_run_complete {int(complete)}",
+            "# HELP ccdupe_last_update_timestamp_seconds When these metrics were written.",
+            "# TYPE ccdupe_last_update_timestamp_seconds gauge",
+            f"ccdupe_last_update_timestamp_seconds {time.time():.3f}",
+        ]
+
+        # node_exporter may read at any moment, so it must only ever see a complete file
+        tmp_path = f"{self.metrics_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.metrics_file)
+        self._last_metrics = time.monotonic()
+
+    def _maybe_checkpoint(self, force=False):
+        """ Writes a checkpoint if one is configured and the interval has elapsed. """
+        if not self.checkpoint_file:
+            return
+        if force or time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+            self.save_checkpoint()
+
+    def save_checkpoint(self):
+        """ Atomically writes the pipeline state to the checkpoint file (gzipped JSON). """
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "directory": os.path.abspath(self.directory),
+            "min_size": self.min_size,
+            "frontier": self.frontier,
+            "walked_dirs": self.walked_dirs,
+            # One row per file keeps the checkpoint compact: [path, size, mtime_ns, md5 or null]
+            "files": [[path, size, mtime, self.file_hashes.get(path)]
+                      for path, (size, mtime, _) in self.file_stats.items()],
+            "verified_hashes": sorted(self.verified_hashes),
+            "verified_clusters": self.verified_clusters,
+        }
+
+        tmp_path = f"{self.checkpoint_file}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=1) as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(tmp_path, self.checkpoint_file)  # Never leaves a half-written checkpoint behind
+        self._last_checkpoint = time.monotonic()
+
+    def load_checkpoint(self):
+        """ Restores pipeline state from the checkpoint, dropping anything that changed on disk since. """
+        with gzip.open(self.checkpoint_file, "rt", encoding="utf-8") as f:
+            state = json.load(f)
+
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise ValueError("unsupported checkpoint version")
+        if state["directory"] != os.path.abspath(self.directory) or state["min_size"] != self.min_size:
+            raise ValueError(f"checkpoint was taken for {state['directory']} with --minsize={state['min_size']}")
+
+        self.frontier = [folder for folder in state["frontier"] if os.path.lexists(folder)]  # Some may be deleted
+        self.walked_dirs = state["walked_dirs"]
+        self.verified_hashes = set(state["verified_hashes"])
+        for file_size, file_hash, cluster in state["verified_clusters"]:
+            self.verified_clusters.append((file_size, file_hash, cluster))
+            self.verified_duplicates.extend((cluster[0], file) for file in cluster[1:])
+
+        changed = set()
+        for path, size, mtime, file_hash in state["files"]:
+            try:
+                st = os.lstat(path)
+            except OSError:
+                changed.add(path)  # Deleted since the checkpoint
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime):
+                changed.add(path)  # Modified since the checkpoint: walk result and hash are stale
+                self._add_file(path, st)
+                continue
+            self.file_stats[path] = (size, mtime, st.st_ctime_ns)
+            self.size_map[size].append(path)
+            if self.stats:
+                self.stats.funnel["files"] += 1  # Walked before the checkpoint; changed ones go through _add_file
+            if file_hash:
+                self.file_hashes[path] = file_hash
+
+        # Directories whose listing changed may hold new files or subdirectories
+        pending = set(self.frontier)
+        for root, mtime in list(self.walked_dirs.items()):
+            try:
+                if os.stat(root).st_mtime_ns == mtime:
+                    continue
+                self.walked_dirs[root] = os.stat(root).st_mtime_ns
+                with os.scandir(root) as entries:
+                    for entry in entries:
+                        # Same per-entry tolerance as _walk: a broken link must not hide the entries after it
+                        try:
+                            if entry.is_dir():
+                                if not entry.is_symlink() and entry.path not in self.walked_dirs \
+                                        and entry.path not in pending and not self._skip_quarantine(entry.path):
+                                    self.frontier.append(entry.path)
+                            elif entry.path not in self.file_stats and entry.path not in changed:
+                                self._add_file(entry.path, entry.stat(follow_symlinks=False))
+                                changed.add(entry.path)
+                        except OSError as e:
+                            self._walk_error(entry.path, e)
+            except FileNotFoundError:
+                del self.walked_dirs[root]  # Deleted since the checkpoint, not unreadable; its files were dropped above
+            except OSError as e:
+                del self.walked_dirs[root]  # Unreadable; its files were checked one by one above
+                self._walk_error(root, e)
+
+        # Hash groups that lost a member must be verified again from scratch
+        old_hashes = {path: file_hash for path, _, _, file_hash in state["files"] if file_hash}
+        for path in changed:
+            if path in old_hashes:
+                self._invalidate_hash_group(old_hashes[path], old_hashes)
+        if self.stats:
+            for _, _, cluster in self.verified_clusters:
+                self.stats.count_funnel("verified", cluster)  # Still valid, so never verified again
+
+        print(f"♻️  Resumed from checkpoint: {len(self.file_stats)} files, "
+              f"{len(self.file_hashes)} already hashed, {len(changed)} changed since the checkpoint")
+
+    def _invalidate_hash_group(self, file_hash, hashes):
+        """ Forgets the byte-by-byte results of a hash group so it gets verified again. """
+        if file_hash in self.verified_hashes:
+            self.verified_hashes.discard(file_hash)
+            self.verified_duplicates = [pair for pair in self.verified_duplicates
+                                        if hashes.get(pair[0]) != file_hash]
+            for cluster in self.verified_clusters:
+                if cluster[1] == file_hash:
+                    self._withdraw(cluster)  # Already streamed; the group's new clusters follow
+            self.verified_clusters = [cluster for cluster in self.verified_clusters if cluster[1] != file_hash]
+
+    def _stage(self, name):
+        """ Times a block as one stage when --stats is on; a no-op context otherwise. """
+        return self.stats.stage(name) if self.stats else NO_STAGE
+
+    def _span(self, name, category, **args):
+        """ Records a block as one trace span when --trace is on; a no-op context otherwise. """
+        return self.tracer.span(name, category, **args) if self.tracer else NO_STAGE
+
+    def _time_left(self):
+        """ Seconds left in the time budget, or None when the run is unbounded. """
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def _fits_in_budget(self, file_size, files):
+        """ Checks whether a size group can still be finished before the deadline. """
+        time_left = self._time_left()
+        if time_left is None:
+            return True
+        if time_left <= 0:
+            return False
+        if not self.hash_seconds:
+            return True  # No throughput measured yet, so try it
+
+        # Every unhashed file is read once to hash it and about once more to verify it
+        pending = sum(1 for file in files if file not in self.file_hashes) or len(files)
+        rate = self.hashed_bytes / self.hash_seconds
+        return 2 * file_size * pending / rate <= time_left
+
+    def _process_size_group(self, file_size, files):
+        """ Hashes and verifies one size group. Returns False if the deadline cut it short. """
+        if file_size > PREFIX_BYTES and any(file not in self.file_hashes for file in files):
+            # Files that already differ in their first block never need a full hash
+            by_prefix = defaultdict(list)
+            with self._stage("prefix"):
                 for file in files:
-                    file_path = os.path.join(root, file)
-                    file_size = os.path.getsize(file_path)  # Get file size
-                    
-                    # Ignore files smaller than min_size
-                    if file_size < self.min_size:
-                        continue  
-
-                    self.size_map[file_size].append(file_path)
-        except Exception as e:
-            print(f"❌ Error scanning directory: {e}")
+                    partial = self.get_partial_hash(file)
+                    if partial is not None:
+                        by_prefix[partial].append(file)
+            files = [file for group in by_prefix.values() if len(group) > 1 for file in group]
+        if self.stats:
+            self.stats.count_funnel("same_prefix", files)
+
+        group_hashes = defaultdict(list)
+        for file in files:
+            file_hash = self.file_hashes.get(file)  # Already hashed before a resume
+            if file_hash is None:
+                time_left = self._time_left()
+                if (time_left is not None and time_left <= 0) or self.cancelled:
+                    return False
+
+                started = time.monotonic()
+                with self._stage("hash"):
+                    file_hash = self.get_file_hash(file)
+                self.hash_seconds += time.monotonic() - started
+                self.hashed_bytes += file_size
+                self.candidate_bytes_left -= file_size
+
+                if file_hash:
+                    # A new member means the group's earlier verification is incomplete
+                    self._invalidate_hash_group(file_hash, self.file_hashes)
+                    self.file_hashes[file] = file_hash
+                    self._tick()
+
+            if file_hash:
+                group_hashes[file_hash].append(file)
+
+        for file_hash, same_hash in group_hashes.items():
+            self.hash_map[file_hash] = same_hash
+            if len(same_hash) > 1 and self.stats:
+                self.stats.count_funnel("same_hash", same_hash)
+            if len(same_hash) > 1 and file_hash not in self.verified_hashes:  # Confirmed hash duplicates
+                with self._stage("verify"), self._span("verify", "verify", size=file_size, files=len(same_hash)):
+                    if not self._verify_hash_group(file_size, file_hash, same_hash):
+                        return False  # Cancelled half way; the group stays unverified
+                self.verified_hashes.add(file_hash)
+                self._tick()
+        return True
+
+    def _verify_hash_group(self, file_size, file_hash, files):
+        """ Splits a hash group into clusters of byte-identical files. Returns False if cancelled. """
+        # Each file is compared against one representative per cluster instead of every other file
+        clusters = []
+        for file in files:
+            if self.cancelled:
+                return False  # Nothing recorded yet, so a half-compared group is never reported
+            for cluster in clusters:
+                if self.byte_by_byte_comparison(cluster[0], file):
+                    cluster.append(file)
+                    break
+            else:
+                clusters.append([file])
+
+        if any(file in self.changed for file in files):
+            # A member changed while being compared, so a match against it may be stale: record nothing,
+            # _requeue_changed verifies the whole group again
+            return True
+
+        for cluster in clusters:
+            if len(cluster) > 1:
+                self.verified_duplicates.extend((cluster[0], file) for file in cluster[1:])
+                self.verified_clusters.append((file_size, file_hash, cluster))
+                if self.stats:
+                    self.stats.count_funnel("verified", cluster)
+                self._stream(self.verified_clusters[-1])
+        return True
+
+    def _stream(self, cluster):
+        """ Streams a confirmed cluster, withdrawing what was streamed for it before. """
+        if self.result_writer:
+            self._withdraw(cluster)
+            file_size, file_hash, files = cluster
+            # Holding the list keeps its id from being reused while the record is outstanding
+            self.streamed[id(files)] = (file_size, file_hash, list(files), files)
+            self.result_writer.emit(file_size, file_hash, files)
+
+    def _withdraw(self, cluster):
+        """ Withdraws the streamed record of a cluster that no longer holds, if it was streamed. """
+        streamed = self.streamed.pop(id(cluster[2]), None)
+        if streamed:
+            self.result_writer.withdraw(*streamed[:3])
 
     def get_file_hash(self, file_path):
         """ Computes the MD5 hash of a file. """
+        try:
+            with self._span("hash", "hash", path=file_path):
+                file_hash, st = self.reader.run(self._read_hash, file_path)
+            if file_hash is not None and self._changed(file_path, st):
+                return None  # Hashed mid-write; find_true_duplicates re-queues it
+            return file_hash
+        except TimeoutError as e:
+            self._defer(file_path, e)
+            return None
+        except Exception as e:
+            print(f"❌ Error hashing file {file_path}: {e}")
+            if self.stats:
+                self.stats.io_errors += 1
+            return None
+
+    def _read_hash(self, file_path):
+        """ MD5 of a file and its fstat once read, to compare with the stat taken by the walk. """
         hasher = hashlib.md5()
+        with open(file_path, "rb") as f:
+            while chunk := f.read(4096):  # Read file in chunks (efficient)
+                hasher.update(chunk)
+                self.reader.beat()
+                if self.cancelled:
+                    return None, None  # Don't finish a huge file after Ctrl-C
+            if self.stats:
+                self.stats.count_read(f.tell(), f.tell() // 4096 + 1)
+            return hasher.hexdigest(), os.fstat(f.fileno())
+
+    def _changed(self, file_path, st):
+        """ Checks a file's stat after reading it against the walk's; changed files are queued again. """
+        known = self.file_stats.get(file_path)
+        signature = (st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+        if known is None or known == signature:
+            return False
+        self.changed[file_path] = signature
+        return True
+
+    def get_partial_hash(self, file_path):
+        """ MD5 of the first PREFIX_BYTES bytes: cheap, and tells most same-size files apart. """
         try:
-            with open(file_path, "rb") as f:
-                while chunk := f.read(4096):  # Read file in chunks (efficient)
-                    hasher.update(chunk)
-            return hasher.hexdigest()
+            return self.reader.run(self._read_partial_hash, file_path)
+        except TimeoutError as e:
+            self._defer(file_path, e)
+            return None
         except Exception as e:
             print(f"❌ Error hashing file {file_path}: {e}")
+            if self.stats:
+                self.stats.io_errors += 1
             return None
 
+    def _read_partial_hash(self, file_path):
+        with open(file_path, "rb") as f:
+            prefix = f.read(PREFIX_BYTES)
+        if self.stats:
+            self.stats.count_read(len(prefix), 1)
+        return hashlib.md5(prefix).digest()
+
+    def _defer(self, file_path, error):
+        """ Puts aside a file whose read missed its deadline; find_true_duplicates retries it at the end. """
+        print(f"⏳ Deferred {file_path}: {error.strerror}")
+        self.deferred.append(file_path)
+        if self.stats:
+            self.stats.io_errors += 1
+
     def byte_by_byte_comparison(self, file1, file2):
         """ Compares two files byte by byte to confirm they are identical. """
         try:
-            with open(file1, "rb") as f1, open(file2, "rb") as f2:
+            identical, st1, st2 = self.reader.run(self._compare, file1, file2)
+            # Both are checked, so each file that changed gets re-queued
+            if self._changed(file1, st1) | self._changed(file2, st2):
+                return False  # Not trusted either way; the whole hash group is verified again
+            return identical
+        except Exception as e:
+            # A timeout here just leaves the pair unconfirmed; both files were readable moments ago
+            print(f"❌ Error comparing files {file1} and {file2}: {e}")
+            if self.stats:
+                self.stats.io_errors += 1
+            return False
+
+    def _compare(self, file1, file2):
+        """ Whether two files are identical, plus the fstat of each once read. """
+        with open(file1, "rb") as f1, open(file2, "rb") as f2:
+            identical = True
+            try:
                 while True:
                     chunk1 = f1.read(4096)
                     chunk2 = f2.read(4096)
 
                     if chunk1 != chunk2:
-                        return False  # Files are different
+                        identical = False  # Files are different
+                        break
 
                     if not chunk1:  # End of file
                         break
-            return True  # Files are identical
-        except Exception as e:
-            print(f"❌ Error comparing files {file1} and {file2}: {e}")
-            return False
+                    self.reader.beat()
+            finally:
+                if self.stats:
+                    read = f1.tell() + f2.tell()
+                    self.stats.count_read(read, read // 4096 + 2, files=2)
+            return identical, os.fstat(f1.fileno()), os.fstat(f2.fileno())
+
+    def find_duplicate_directories(self):
+        """ Finds whole identical subtrees with Merkle hashes and reports each one once. """
+        print("\n🌳 Checking for duplicate directories using Merkle hashes...")
+        if self.min_size:
+            # Smaller files were never indexed, so directories differing only in them would look alike
+            print("⚠️  Skipped: --dirs needs every file, so it cannot be combined with --minsize.")
+            return []
+
+        top = os.path.dirname(os.path.join(self.directory, "x"))  # Spelled the way walked paths spell it
+        files_in = defaultdict(list)
+        dirs_in = defaultdict(list)
+        for file in self.file_stats:
+            files_in[os.path.dirname(file)].append(file)
+        folders = [top if folder == self.directory else folder for folder in self.walked_dirs]
+        for folder in folders:
+            if folder != top:
+                dirs_in[os.path.dirname(folder)].append(folder)
+        folders.sort(key=lambda folder: folder.count(os.sep), reverse=True)  # Children before parents
+
+        # Pass 1: a shape hash from names and sizes only. Directories with a unique shape cannot
+        # have a twin, so only the files under colliding shapes ever need to be read
+        shapes = {}
+        totals = {}  # Directory -> (file count, bytes) of the whole subtree
+        for folder in folders:
+            entries = [(os.path.basename(f), self.file_stats[f][0]) for f in files_in[folder]]
+            entries += [(os.path.basename(d), shapes[d]) for d in dirs_in[folder]]
+            shapes[folder] = hash(tuple(sorted(entries)))
+            totals[folder] = (len(files_in[folder]) + sum(totals[d][0] for d in dirs_in[folder]),
+                              sum(self.file_stats[f][0] for f in files_in[folder])
+                              + sum(totals[d][1] for d in dirs_in[folder]))
+
+        shape_counts = defaultdict(int)
+        for folder in folders:
+            if totals[folder][0]:  # Empty directories are all alike and not worth reporting
+                shape_counts[shapes[folder]] += 1
+
+        # Pass 2: the Merkle hash of each candidate from its children's names and content digests.
+        # Empty directories cost nothing to hash and are part of their parent's contents
+        merkle = {}
+        for folder in folders:
+            if totals[folder][0] and shape_counts[shapes[folder]] < 2:
+                continue
+            hasher = hashlib.md5()
+            entries = []
+            for file in files_in[folder]:
+                file_hash = self.file_hashes.get(file) or self.get_file_hash(file)
+                if file_hash is None:
+                    break  # Unreadable file: the directory cannot be proven identical
+                self.file_hashes[file] = file_hash
+                entries.append((os.path.basename(file), "f", file_hash))
+            else:
+                if all(d in merkle for d in dirs_in[folder]):
+                    entries += [(os.path.basename(d), "d", merkle[d]) for d in dirs_in[folder]]
+                    for entry in sorted(entries):
+                        hasher.update("\0".join(entry).encode("utf-8", "surrogateescape") + b"\n")
+                    merkle[folder] = hasher.hexdigest()
+
+        groups = defaultdict(list)
+        for folder, digest in merkle.items():
+            if totals[folder][0]:  # Empty directories are all alike and not worth reporting
+                groups[digest].append(folder)
+
+        # Equal Merkle hashes only mean equal MD5s, which the file-level pass never trusts alone either:
+        # every copy is compared byte by byte with the first directory of its group
+        same = {}
+
+        def identical(folder, copy):
+            if (folder, copy) not in same:
+                same[folder, copy] = all(
+                    self.byte_by_byte_comparison(file, os.path.join(copy, os.path.basename(file)))
+                    for file in files_in[folder]) and all(
+                    identical(child, os.path.join(copy, os.path.basename(child))) for child in dirs_in[folder])
+            return same[folder, copy]
+
+        duplicate_groups = []
+        for group in groups.values():
+            group.sort()
+            copies = [folder for folder in group[1:] if identical(group[0], folder)]
+            for folder in sorted(set(group[1:]) - set(copies)):
+                print(f"⚠️  {folder} has the Merkle hash of {group[0]} but not the same bytes")
+            if copies:
+                duplicate_groups.append([group[0]] + copies)
+        in_groups = {folder for group in duplicate_groups for folder in group}
+
+        # Nested matches are implied by their parents, so only the outermost twins are reported
+        def is_nested(folder):
+            return folder != top and os.path.dirname(folder) in in_groups
+
+        reported = []
+        for group in duplicate_groups:
+            outer = [folder for folder in group if not is_nested(folder)]
+            if len(outer) == 1:
+                outer.insert(0, group[0] if group[0] != outer[0] else group[1])  # Show what it copies
+            if outer:
+                reported.append(outer)
+        reported.sort(key=lambda group: totals[group[0]][1] * (len(group) - 1), reverse=True)
+
+        if not reported:
+            print("✅ No duplicate directories found.")
+            return []
+
+        print("\n🔥 Duplicate Directories:")
+        for group in reported:
+            count, size = totals[group[0]]
+            print(f"\n  {count} files, {size} bytes each:")
+            for folder in group:
+                print(f"  - {folder}")
+
+        # Files inside the extra copies are already accounted for; keep them out of the file-level pass
+        extra = tuple(os.path.join(folder, "") for group in reported for folder in group[1:])
+        for file_size, files in self.size_map.items():
+            self.size_map[file_size] = [file for file in files if not file.startswith(extra)]
+        return reported
 
     def find_true_duplicates(self):
         """ Identifies exact duplicate files using MD5 hashing and byte-by-byte comparison. """
         print("\n🔍 Checking for true duplicates using MD5 hashing...")
+        print("\n✅ Verifying duplicates with byte-by-byte comparison...")
 
-        for file_size, files in self.size_map.items():
-            if len(files) > 1:  # Only hash files that have potential duplicates
-                for file in files:
-                    file_hash = self.get_file_hash(file)
+        resumed = list(self.verified_clusters)  # Confirmed before a resume, so not streamed yet
 
-                    if file_hash:
-                        self.hash_map[file_hash].append(file)
+        # Largest potential savings first: size * (count - 1) bytes are freed if a whole group is identical
+        queue = [(-size * (len(files) - 1), size) for size, files in self.size_map.items() if len(files) > 1]
+        heapq.heapify(queue)
+        self.candidates_left = sum(len(self.size_map[size]) for _, size in queue)
+        self.candidate_bytes = self.candidate_bytes_left = sum(size * len(self.size_map[size]) for _, size in queue)
+        self.phase_started = time.monotonic()
+        self.phase = "duplicates"
+        if self.stats:
+            self.stats.count_funnel("same_size", (file for _, size in queue for file in self.size_map[size]))
 
-        # Byte-by-byte verification
-        print("\n✅ Verifying duplicates with byte-by-byte comparison...")
+        skipped_groups = 0
+        skipped_bytes = 0
+        while queue and not self.cancelled:
+            neg_reclaimable, file_size = heapq.heappop(queue)
+            files = self.size_map[file_size]
+            bytes_left = self.candidate_bytes_left
+            if not self._fits_in_budget(file_size, files) or not self._process_size_group(file_size, files):
+                skipped_groups += 1
+                skipped_bytes -= neg_reclaimable
+            self.candidates_left -= len(files)
+            self.candidate_bytes_left = bytes_left - file_size * len(files)  # Including files the prefix ruled out
+
+        if self.deferred and not self.cancelled:
+            self._retry_deferred()
+        if self.changed and not self.cancelled:
+            self._requeue_changed()
+
+        self._maybe_checkpoint(force=True)
+
+        for cluster in resumed:
+            if cluster in self.verified_clusters:  # Still valid after re-hashing changed files
+                self._stream(cluster)
+
+        if skipped_groups and not self.cancelled:
+            print(f"\n⏱ Time budget reached: {skipped_groups} size groups "
+                  f"(up to {skipped_bytes} reclaimable bytes) were left unchecked.")
+
+        if not self.verified_clusters and not self.cancelled:
+            print("✅ No final duplicate files found after byte-by-byte comparison.")
+
+    def _recheck_size_group(self, file_size):
+        """ Processes a size group again, counting the files it still has to hash as work left for --progress. """
+        files = self.size_map[file_size]
+        pending = sum(1 for file in files if file not in self.file_hashes)
+        self.candidates_left += pending
+        self.candidate_bytes += pending * file_size
+        self.candidate_bytes_left += pending * file_size
+        bytes_left = self.candidate_bytes_left
+        if self.stats:
+            self.stats.count_funnel("same_size", files)  # A changed file may have moved to a new size group
+        self._process_size_group(file_size, files)
+        self.candidates_left -= pending
+        self.candidate_bytes_left = bytes_left - pending * file_size
+
+    def _retry_deferred(self):
+        """ Gives files that missed their read deadline one more try, with a four times longer deadline. """
+        sizes = sorted({self.file_stats[file][0] for file in self.deferred if file in self.file_stats}, reverse=True)
+        self.reader.timeout *= 4
+        print(f"\n⏳ Retrying {len(self.deferred)} deferred files with a {self.reader.timeout:g}s deadline...")
+        self.deferred = []
+        for file_size in sizes:
+            if self.cancelled:
+                break
+            # Files already hashed are skipped, and a late member reopens its hash group for verification
+            self._recheck_size_group(file_size)
+
+        if self.deferred:
+            print(f"⚠️  {len(self.deferred)} files never answered and were left out:")
+            for file in self.deferred:
+                print(f"  - {file}")
+
+    def _requeue_changed(self):
+        """ Hashes and verifies files that changed while being read again, until they hold still. """
+        while self.changed and not self.cancelled:
+            changed, self.changed = self.changed, {}
+            sizes = set()
+            for file, signature in changed.items():
+                old_size = self.file_stats[file][0]
+                if file in self.file_hashes:
+                    # Changed during verification: nothing compared against it can be trusted
+                    self._invalidate_hash_group(self.file_hashes[file], self.file_hashes)
+                self._forget_file(file)
+
+                self.change_attempts[file] += 1
+                if self.change_attempts[file] > CHANGE_RETRIES:
+                    self.unstable.append(file)
+                    sizes.add(old_size)  # Its old group was invalidated and must be verified without it
+                    continue
+                self.file_stats[file] = signature
+                self.size_map[signature[0]].append(file)
+                sizes.update((old_size, signature[0]))
+
+            print(f"\n🔄 Re-checking {len(changed)} files that changed while being read...")
+            for file_size in sorted(sizes, reverse=True):
+                if len(self.size_map[file_size]) > 1 and not self.cancelled:
+                    self._recheck_size_group(file_size)
+
+        if self.unstable:
+            print(f"⚠️  {len(self.unstable)} files kept changing while being read and were left out:")
+            for file in self.unstable:
+                print(f"  - {file}")
+
+    def save_to_database(self, db_file):
+        """ Bulk-loads the scan results into indexed SQLite tables for ad-hoc queries. """
+        db = sqlite3.connect(db_file)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(DB_SCHEMA)
+
+            base = os.path.abspath(self.directory)
+            with db:  # One transaction for the whole load
+                db.execute("DELETE FROM cluster_files")
+                db.execute("DELETE FROM clusters")
+                db.execute("DELETE FROM files")
+
+                file_ids = {}
+                rows = []
+                for file, (size, mtime, _) in self.file_stats.items():
+                    file_ids[file] = len(file_ids) + 1
+                    folder = os.path.dirname(os.path.abspath(file))
+                    # Top-level directory under the scanned one, used for the cross-root overlap query
+                    root = os.path.relpath(folder, base).split(os.sep)[0]
+                    rows.append((file_ids[file], file, folder, root, size, mtime, self.file_hashes.get(file)))
+                db.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+                db.executemany("INSERT INTO clusters VALUES (?, ?, ?, ?, ?)",
+                               ((cluster_id, size, file_hash, len(files), size * (len(files) - 1))
+                                for cluster_id, (size, file_hash, files) in enumerate(self.verified_clusters, 1)))
+                db.executemany("INSERT INTO cluster_files VALUES (?, ?)",
+                               ((cluster_id, file_ids[file])
+                                for cluster_id, (_, _, files) in enumerate(self.verified_clusters, 1)
+                                for file in files))
+        finally:
+            db.close()
+
+        print(f"\n🗄 Saved {len(self.file_stats)} files and {len(self.verified_clusters)} clusters to {db_file}")
+
+    def directory_report(self, rules, top_n=20):
+        """ Rolls duplicate bytes up the directory tree and prints the heaviest subtrees, du style. """
+        # Directories are interned to integer ids; a parent always gets its id before its children,
+        # so one reverse pass over the ids adds every subtree into its parent
+        dir_ids = {}
+        names = []
+        parents = []
+        waste = []
+        top = os.path.dirname(os.path.join(self.directory, "x"))  # Spelled the way walked paths spell it
+
+        def intern(folder):
+            dir_id = dir_ids.get(folder)
+            if dir_id is None:
+                parent = os.path.dirname(folder)
+                parent_id = intern(parent) if folder != top and parent != folder else -1
+                dir_id = dir_ids[folder] = len(names)
+                names.append(folder)
+                parents.append(parent_id)
+                waste.append(0)
+            return dir_id
+
+        intern(top)
+        for keeper, duplicates in self.plan_cleanup(rules):
+            size = self.file_stats[keeper][0]
+            for file in duplicates:
+                waste[intern(os.path.dirname(file))] += size
+
+        for dir_id in range(len(names) - 1, 0, -1):
+            if parents[dir_id] >= 0:
+                waste[parents[dir_id]] += waste[dir_id]
+
+        print(f"\n📁 Top {top_n} directories by duplicate bytes (including subdirectories):")
+        for dir_id in heapq.nlargest(top_n, (i for i in range(len(names)) if waste[i]), key=waste.__getitem__):
+            print(f"  {waste[dir_id]:>14}  {names[dir_id]}")
+
+        # du prints children before their parent; sorting by path and reversing does the same
+        print("\n📋 Duplicate bytes per directory:")
+        for dir_id in sorted((i for i in range(len(names)) if waste[i]), key=names.__getitem__, reverse=True):
+            print(f"{waste[dir_id]}\t{names[dir_id]}")
+
+    def watch(self):
+        """ Keeps the index up to date from inotify events and reports new duplicates as they appear. """
+        if not sys.platform.startswith("linux"):
+            print("❌ --watch needs Linux inotify.")
+            return
 
-        for file_hash, files in self.hash_map.items():
-            if len(files) > 1:  # Confirmed hash duplicates
-                for i in range(len(files)):
-                    for j in range(i + 1, len(files)):
-                        if self.byte_by_byte_comparison(files[i], files[j]):
-                            self.verified_duplicates.append((files[i], files[j]))
+        inotify = Inotify()
+        for folder in self.walked_dirs:
+            inotify.add_watch(folder)
+        print(f"\n👀 Watching {len(inotify.watches)} directories for changes (Ctrl-C to stop)...")
 
+        try:
+            while True:
+                for mask, path in inotify.read_events():
+                    if mask & IN_Q_OVERFLOW:
+                        print("⚠️  Missed some events (queue overflow); re-checking the whole tree.")
+                        self._rescan(inotify)
+                    elif mask & IN_ISDIR:
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            self._watch_new_directory(inotify, path)
+                        else:  # Deleted or moved away: everything below it left the tree
+                            inotify.forget(path)
+                            prefix = os.path.join(path, "")
+                            for file in [file for file in self.file_stats if file.startswith(prefix)]:
+                                self._forget_file(file)
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        self._forget_file(path)
+                    elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                        self._forget_file(path)
+                        self._index_new_file(path)
+        except KeyboardInterrupt:
+            print("\n👋 Stopped watching.")
+        finally:
+            os.close(inotify.fd)
+
+    def _watch_new_directory(self, inotify, folder):
+        """ Watches a directory that appeared while watching and indexes everything inside it. """
+        walker = DuplicateFileFinder(folder, self.min_size)
+        walker.scan_directory()
+        for path in walker.walked_dirs:
+            inotify.add_watch(path)
+            self.walked_dirs[path] = walker.walked_dirs[path]
+        for file in walker.file_stats:
+            self._index_new_file(file)
+
+    def _rescan(self, inotify):
+        """ Reconciles the index with the disk after inotify lost events. """
+        walker = DuplicateFileFinder(self.directory, self.min_size)
+        walker.scan_directory()
+        for file in set(self.file_stats) - set(walker.file_stats):
+            self._forget_file(file)
+        for file, stat in walker.file_stats.items():
+            if self.file_stats.get(file) != stat:
+                self._forget_file(file)
+                self._index_new_file(file)
+        for folder in walker.walked_dirs:
+            if folder not in inotify.watches:
+                inotify.add_watch(folder)
+
+    def _forget_file(self, file_path):
+        """ Removes a file from every index after it was deleted, moved away or rewritten. """
+        file_stat = self.file_stats.pop(file_path, None)
+        if file_stat is None:
+            return
+        # --dirs prunes copies from size_map, and files ruled out by the prefix never reach hash_map
+        if file_path in self.size_map.get(file_stat[0], ()):
+            self.size_map[file_stat[0]].remove(file_path)
+        file_hash = self.file_hashes.pop(file_path, None)
+        if file_hash is None:
+            return
+
+        if file_path in self.hash_map.get(file_hash, ()):
+            self.hash_map[file_hash].remove(file_path)
+        for cluster in self.verified_clusters:
+            if cluster[1] == file_hash and file_path in cluster[2]:
+                cluster[2].remove(file_path)
+                if len(cluster[2]) > 1:
+                    self._stream(cluster)
+                else:
+                    self._withdraw(cluster)
+        self.verified_clusters = [cluster for cluster in self.verified_clusters if len(cluster[2]) > 1]
+        self.verified_duplicates = [pair for pair in self.verified_duplicates if file_path not in pair]
+
+    def _index_new_file(self, file_path):
+        """ Indexes a new or rewritten file, reading only it and any same-size file not hashed yet. """
+        try:
+            st = os.lstat(file_path)
+        except OSError:
+            return  # Already gone again
+        self._add_file(file_path, st)
+        same_size = self.size_map.get(st.st_size, [])
+        if file_path not in self.file_stats or len(same_size) < 2:
+            return  # Too small, or nothing of this size to duplicate
+
+        for file in same_size:
+            if file not in self.file_hashes:
+                file_hash = self.get_file_hash(file)
+                if file_hash:
+                    self.file_hashes[file] = file_hash
+                    self.hash_map[file_hash].append(file)
+
+        file_hash = self.file_hashes.get(file_path)
+        for cluster in self.verified_clusters:
+            if cluster[1] == file_hash and self.byte_by_byte_comparison(cluster[2][0], file_path):
+                cluster[2].append(file_path)
+                self.verified_duplicates.append((cluster[2][0], file_path))
+                print(f"🔥 New duplicate: {file_path} == {cluster[2][0]}")
+                self._stream(cluster)  # Replaces the record streamed before it grew
+                return
+
+        # No known cluster yet: compare with the other files of the same content hash
+        for other in self.hash_map.get(file_hash, []):
+            if other != file_path and self.byte_by_byte_comparison(other, file_path):
+                cluster = (st.st_size, file_hash, [other, file_path])
+                self.verified_clusters.append(cluster)
+                self.verified_duplicates.append((other, file_path))
+                print(f"🔥 New duplicate: {file_path} == {other}")
+                self._stream(cluster)
+                return
+
+    def serve(self, socket_path):
+        """ Answers "is this a known duplicate?" lookups over a Unix socket until interrupted. """
+        if not self._claim_socket(socket_path):
+            return
+        self._index_digests()
+
+        server = socketserver.ThreadingUnixStreamServer(socket_path, LookupHandler)
+        server.daemon_threads = True
+        server.finder = self
+
+        print(f"\n🛰 Serving lookups for {len(self.file_stats)} files on {socket_path} (Ctrl-C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\n👋 Stopped serving.")
+        finally:
+            server.server_close()
+            os.remove(socket_path)
+
+    def _index_digests(self):
+        """ Hashes every file not hashed yet and builds the (size, md5) index that lookup() answers from. """
+        # Every digest is known before the first request, so a lookup never waits on disk reads
+        missing = [file for file in self.file_stats if file not in self.file_hashes]
+        if missing:
+            print(f"\n#️⃣  Hashing {len(missing)} files before serving (--checkpoint keeps them for next time)...")
+        for file in missing:
+            file_hash = self.get_file_hash(file)
+            if file_hash:
+                self.file_hashes[file] = file_hash
+            self._tick()
+        self._maybe_checkpoint(force=True)
+
+        self.digest_index = {}  # (size, md5) -> files
+        for file, file_hash in self.file_hashes.items():
+            if file in self.file_stats:
+                self.digest_index.setdefault((self.file_stats[file][0], file_hash), []).append(file)
+
+        # Handler threads share self.reader and self.stats, which are not thread-safe: one read at a time
+        self.read_lock = threading.Lock()
+
+    def _claim_socket(self, socket_path):
+        """ Removes a stale socket left by a daemon that died; refuses anything else at that path. """
+        try:
+            st = os.stat(socket_path)
+        except FileNotFoundError:
+            return True
+        if not stat.S_ISSOCK(st.st_mode):
+            print(f"❌ {socket_path} exists and is not a socket; not touching it.")
+            return False
+
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except ConnectionRefusedError:
+            os.remove(socket_path)  # Nobody is listening: left behind by a previous daemon
+            return True
+        except OSError as e:
+            print(f"❌ Cannot check {socket_path}: {e}")
+            return False
+        finally:
+            probe.close()
+        print(f"❌ Another daemon is already serving on {socket_path}.")
+        return False
+
+    def lookup(self, line):
+        """ Handles one request line: "PATH <file>" or "DIGEST <size> <md5>". Returns a JSON reply line. """
+        try:
+            command, _, argument = line.decode("utf-8", "surrogateescape").strip().partition(" ")
+            if command == "PATH":
+                st = os.stat(argument)
+                if not stat.S_ISREG(st.st_mode):
+                    raise ValueError(f"{argument} is not a regular file")
+                if st.st_size not in self.size_map:
+                    matches = []  # No file of that size: unique without reading anything
+                else:
+                    # Read errors and timeouts become the reply instead of a message on the daemon's stdout
+                    with self.read_lock:
+                        file_hash, _ = self.reader.run(self._read_hash, argument)
+                    if file_hash is None:
+                        raise ValueError("stopped before the file was read")
+                    path = os.path.abspath(argument)
+                    matches = [file for file in self._lookup(st.st_size, file_hash) if os.path.abspath(file) != path]
+            elif command == "DIGEST":
+                size, _, file_hash = argument.partition(" ")
+                matches = self._lookup(int(size), file_hash.lower())
+            else:
+                raise ValueError(f"unknown request {command!r}")
+            reply = {"duplicate": bool(matches), "matches": matches}
+        except (OSError, ValueError) as e:
+            reply = {"error": str(e)}
+        return json.dumps(reply).encode("utf-8", "surrogateescape") + b"\n"
+
+    def _lookup(self, file_size, file_hash):
+        """ Files with this size and digest. """
+        return self.digest_index.get((file_size, file_hash), [])
+
+    def emit_shard(self, shard_file, host):
+        """ Writes this host's (size, prefix MD5, full MD5, path) records, sorted, for 'merge'. """
+        records = []
+        for file, (size, _, _) in self.file_stats.items():
+            partial = self.get_partial_hash(file)
+            if partial is not None:
+                records.append([size, partial, None, os.path.abspath(file)])
+        records.sort()
+
+        # Full digests only where this host alone already has a collision; the rest wait for 'merge'
+        for _, group in itertools.groupby(records, key=lambda record: record[:2]):
+            group = list(group)
+            if len(group) > 1 and group[0][0] > PREFIX_BYTES:  # Smaller files are covered by their prefix digest
+                for record in group:
+                    file_hash = self.file_hashes.get(record[3]) or self.get_file_hash(record[3])
+                    record[2] = bytes.fromhex(file_hash) if file_hash else None
+
+        tmp_path = f"{shard_file}.tmp"
+        with open(tmp_path, "wb") as f:
+            encoded_host = host.encode("utf-8")
+            f.write(struct.pack(SHARD_HEADER, SHARD_MAGIC, len(records), len(encoded_host)) + encoded_host)
+            for size, partial, full, path in records:
+                encoded = os.fsencode(path)
+                f.write(struct.pack(SHARD_RECORD, size, partial, full or bytes(16), len(encoded)) + encoded)
+        os.replace(tmp_path, shard_file)
+
+        print(f"\n🧩 Wrote {len(records)} records for host {host} to {shard_file}")
+
+    def build_bloom_filter(self, bloom_file, fp_rate):
+        """ Hashes every walked file and saves a Bloom filter of their (size, MD5) pairs. """
+        print(f"\n🌸 Building a Bloom filter of {len(self.file_stats)} files (false-positive rate {fp_rate:g})...")
+
+        bloom = BloomFilter.create(len(self.file_stats), fp_rate)
+        for file, (size, _, _) in self.file_stats.items():
+            file_hash = self.file_hashes.get(file) or self.get_file_hash(file)
+            if file_hash:
+                self.file_hashes[file] = file_hash
+                bloom.add(size, file_hash)
+        bloom.save(bloom_file)
+
+        file_bytes = os.path.getsize(bloom_file)
+        print(f"💾 Wrote {bloom_file}: {file_bytes} bytes, {bloom.num_hashes} hashes, "
+              f"{file_bytes * 8 / max(bloom.count, 1):.1f} bits per entry")
+
+    def delete_interactively(self):
+        """ Shows each confirmed pair and asks which file to delete. """
         # Display final confirmed duplicates and allow deletion
         if self.verified_duplicates:
             print("\n🔥 Confirmed Duplicates:")
@@ -108,34 +1732,1030 @@ class DuplicateFileFinder:
                 else:
                     print("✅ Skipping deletion.")
 
+    def choose_keeper(self, files, rules, patterns=None):
+        """ Picks the file to keep from a cluster; the first rule decides, later rules break ties.
+        patterns maps each regex: rule to its compiled pattern and is built here when not given. """
+        if patterns is None:
+            patterns = compile_keep_patterns(rules)
+
+        def rank(index):
+            file = files[index]
+            key = []
+            for rule in rules:
+                if rule == "oldest":
+                    key.append(self.file_stats[file][1])
+                elif rule == "newest":
+                    key.append(-self.file_stats[file][1])
+                elif rule == "shortest-path":
+                    key.append(len(file))
+                elif rule.startswith("root:"):
+                    root = os.path.join(os.path.abspath(rule[5:]), "")
+                    key.append(0 if os.path.abspath(file).startswith(root) else 1)
+                elif rule.startswith("regex:"):
+                    key.append(0 if patterns[rule].search(file) else 1)
+            key.append(index)  # Fall back to walk order so the choice is deterministic
+            return key
+
+        return files[min(range(len(files)), key=rank)]
+
+    def plan_cleanup(self, rules):
+        """ Applies the keep rules to every verified cluster: returns [(kept file, [duplicates])]. """
+        plan = []
+        patterns = compile_keep_patterns(rules)
+        for _, _, files in self.verified_clusters:
+            keeper = self.choose_keeper(files, rules, patterns)
+            plan.append((keeper, [file for file in files if file != keeper]))
+        return plan
+
+    def print_plan(self, plan, action="delete"):
+        """ Prints what a cleanup would do without touching any file. """
+        print(f"\n🗂 Cleanup plan ({len(plan)} clusters):")
+        for keeper, duplicates in plan:
+            print(f"  keep    {keeper}")
+            for file in duplicates:
+                print(f"  {action:<7} {file}")
+
+    def write_plan(self, plan, plan_file, workers=8):
+        """ Saves the cleanup plan with enough metadata for 'apply' to re-verify every file later. """
+        def describe(file):
+            """ The plan entry of a file, or None if it is no longer in the state that was verified. """
+            try:
+                st = os.stat(file)
+                sample = sample_digest(file, st.st_size)
+                after = os.stat(file)
+            except OSError:
+                return None
+            # file_stats holds the stat taken right after the file was read for verification
+            signature = (st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+            if signature != self.file_stats.get(file) or signature != (after.st_size, after.st_mtime_ns,
+                                                                       after.st_ctime_ns):
+                return None
+            return {"path": file, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                    "ino": st.st_ino, "dev": st.st_dev, "sample": sample}
+
+        digests = {file: file_hash for _, file_hash, cluster in self.verified_clusters for file in cluster}
+        written = 0
+
+        tmp_path = f"{plan_file}.tmp"
+        with ThreadPoolExecutor(max_workers=workers) as pool, \
+                gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=1) as f:
+            f.write(json.dumps({"version": PLAN_VERSION, "directory": os.path.abspath(self.directory)}) + "\n")
+            for keeper, duplicates in plan:
+                entries = list(pool.map(describe, [keeper] + duplicates))
+                for file, entry in zip([keeper] + duplicates, entries):
+                    if entry is None:
+                        print(f"⚠️  Leaving {file} out of the plan: it changed since it was verified")
+                duplicates = [entry for entry in entries[1:] if entry]
+                if entries[0] is None or not duplicates:
+                    continue
+                cluster = {"digest": digests[keeper], "keep": entries[0], "duplicates": duplicates}
+                f.write(json.dumps(cluster, separators=(",", ":")) + "\n")
+                written += 1
+        os.replace(tmp_path, plan_file)
+
+        print(f"\n📝 Wrote cleanup plan for {written} clusters to {plan_file}")
+
+    def cleanup(self, plan, link=None, journal_file=None, quarantine_dir=None, workers=8):
+        """ Runs the chosen cleanup action (delete, quarantine, hardlink or reflink) over a plan. """
+        plan = self._recheck_plan(plan)
+        if quarantine_dir:
+            self.quarantine_duplicates(plan, quarantine_dir, workers=workers)
+        elif link == "hard":
+            self.hardlink_duplicates(plan, journal_file, workers=workers)
+        elif link == "reflink":
+            self.reflink_duplicates(plan, workers=workers)
         else:
-            print("✅ No final duplicate files found after byte-by-byte comparison.")
+            self.delete_duplicates(plan, workers=workers)
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python ccdupe.py <directory_path> [--minsize=N]")
-        sys.exit(1)
+    def _recheck_plan(self, plan):
+        """ Drops what is no longer safe to clean up: clusters whose kept file is gone or no longer a regular
+        file, and duplicates that are not regular files or are the kept file under another name. """
+        checked = []
+        for keeper, duplicates in plan:
+            try:
+                keeper_stat = os.lstat(keeper)
+            except OSError as e:
+                print(f"⚠️  Skipping cluster of {keeper}: {e}")
+                continue
+            if not stat.S_ISREG(keeper_stat.st_mode):
+                print(f"⚠️  Skipping cluster of {keeper}: the kept file is not a regular file")
+                continue
 
-    directory = sys.argv[1]
-    min_size = 0
+            safe = []
+            for file in duplicates:
+                try:
+                    st = os.lstat(file)
+                except OSError as e:
+                    print(f"⚠️  Skipping {file}: {e}")
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    print(f"⚠️  Skipping {file}: not a regular file")
+                elif (st.st_dev, st.st_ino) != (keeper_stat.st_dev, keeper_stat.st_ino):
+                    safe.append(file)  # A hardlink of the kept file holds no copy to clean up
+            if safe:
+                checked.append((keeper, safe))
+        return checked
+
+    def delete_duplicates(self, plan, workers=8):
+        """ Deletes every duplicate in the plan as one batch, with the unlinks issued in parallel. """
+        victims = [file for _, duplicates in plan for file in duplicates]
+
+        def remove(file):
+            """ Deletes a file: returns (its stat from just before, error). """
+            try:
+                st = os.lstat(file)
+                os.remove(file)
+                return st, None
+            except OSError as e:
+                return None, e
+
+        removed = {}  # (dev, ino) -> [links removed, link count, size]
+        deleted = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for file, (st, error) in zip(victims, pool.map(remove, victims)):
+                if error:
+                    print(f"❌ Error deleting {file}: {error}")
+                else:
+                    deleted += 1
+                    removed.setdefault((st.st_dev, st.st_ino), [0, st.st_nlink, st.st_size])[0] += 1
+        # Only removing the last link to an inode frees its data; a hardlink of the keeper frees nothing
+        freed = sum(size for links, nlink, size in removed.values() if links >= nlink)
+
+        print(f"\n🗑 Deleted {deleted} duplicate files, freeing {freed} bytes.")
+
+    def quarantine_duplicates(self, plan, quarantine_dir, workers=8):
+        """ Moves every duplicate into the quarantine directory, where 'undo' can restore it. """
+        os.makedirs(quarantine_dir, exist_ok=True)
+        with open(os.path.join(quarantine_dir, QUARANTINE_MARKER), "a"):
+            pass  # Keeps later scans out of it, wherever it lives
+        quarantine_dev = os.stat(quarantine_dir).st_dev
+        session = f"{int(time.time())}-{os.getpid()}"
+
+        # Group by parent directory so each worker renames a whole directory through one fd
+        by_parent = defaultdict(list)
+        moves = []
+        for _, duplicates in plan:
+            for file in duplicates:
+                try:
+                    file_dev = os.stat(file).st_dev
+                except OSError as e:
+                    print(f"⚠️  Skipping {file}: {e}")
+                    continue
+                if file_dev != quarantine_dev:
+                    print(f"⚠️  Skipping {file}: not on the same filesystem as {quarantine_dir}")
+                    continue
+                parent, name = os.path.split(os.path.abspath(file))
+                move = {"op": "move", "ts": time.time(), "src": os.path.join(parent, name),
+                        "dst": f"{session}-{len(moves)}-{name}"}
+                moves.append(move)
+                by_parent[parent].append(move)
+
+        # Write-ahead: every move is in the journal before it happens, so 'undo' never loses a file
+        append_journal(quarantine_dir, moves)
+
+        quarantine_fd = os.open(quarantine_dir, os.O_RDONLY)
+
+        def move_directory(parent):
+            moved = 0
+            parent_fd = os.open(parent, os.O_RDONLY)
+            try:
+                for move in by_parent[parent]:
+                    try:
+                        os.rename(os.path.basename(move["src"]), move["dst"],
+                                  src_dir_fd=parent_fd, dst_dir_fd=quarantine_fd)
+                        moved += 1
+                    except OSError as e:
+                        print(f"❌ Error quarantining {move['src']}: {e}")
+            finally:
+                os.close(parent_fd)
+            return moved
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                moved = sum(pool.map(move_directory, list(by_parent)))
+        finally:
+            os.close(quarantine_fd)
+
+        print(f"\n📦 Moved {moved} duplicate files into {quarantine_dir} "
+              f"(python ccdupe.py undo {quarantine_dir} restores them).")
+
+    def hardlink_duplicates(self, plan, journal_file, workers=8):
+        """ Replaces every duplicate with a hardlink to its kept file, all or nothing. """
+        if os.path.exists(journal_file):
+            # Left by a run that crashed; it is the only record of the backups it made
+            print(f"❌ {journal_file} already exists. Run 'python ccdupe.py rollback {journal_file}' first.")
+            return
+
+        entries = []
+        linked = {}  # (dev, ino) -> [links replaced, link count, size]
+        for keeper, duplicates in plan:
+            try:
+                keeper_stat = os.stat(keeper)
+            except OSError as e:
+                print(f"⚠️  Skipping cluster of {keeper}: {e}")
+                continue
+            for file in duplicates:
+                try:
+                    st = os.stat(file)
+                except OSError as e:
+                    print(f"⚠️  Skipping {file}: {e}")
+                    continue
+                if st.st_dev != keeper_stat.st_dev:
+                    print(f"⚠️  Skipping {file}: not on the same device as {keeper}")
+                    continue
+                if st.st_ino == keeper_stat.st_ino:
+                    continue  # Already the same file
+
+                folder, name = os.path.split(file)
+                entries.append({
+                    "path": file,
+                    "keeper": keeper,
+                    "tmp": os.path.join(folder, f".{name}.{os.getpid()}.ccdupe-tmp"),
+                    "backup": os.path.join(folder, f".{name}.{os.getpid()}.ccdupe-bak"),
+                })
+                linked.setdefault((st.st_dev, st.st_ino), [0, st.st_nlink, st.st_size])[0] += 1
+        # Only replacing every link to an inode frees its data, as with delete_duplicates
+        freed = sum(size for links, nlink, size in linked.values() if links >= nlink)
+
+        if not entries:
+            print("\n🔗 Nothing to link: every duplicate is already a hardlink of its kept file.")
+            return
+
+        # The journal is on disk before anything changes, so a crash can always be rolled back
+        with open(journal_file, "x", encoding="utf-8") as journal:
+            journal.write(json.dumps({"action": "hardlink"}) + "\n")
+            for entry in entries:
+                journal.write(json.dumps(entry) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+        def prepare(entry):
+            os.link(entry["path"], entry["backup"])  # Keeps the original data alive until commit
+            os.link(entry["keeper"], entry["tmp"])
+
+        def swap(entry):
+            os.replace(entry["tmp"], entry["path"])  # Atomic: the path always exists
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(prepare, entries))
+                list(pool.map(swap, entries))
+        except OSError as e:
+            print(f"❌ Error linking duplicates, rolling back: {e}")
+            rollback_journal(journal_file)
+            return
+
+        # Commit: the backups are no longer needed
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(os.remove, [entry["backup"] for entry in entries]))
+        os.remove(journal_file)
+
+        print(f"\n🔗 Replaced {len(entries)} duplicate files with hardlinks, freeing {freed} bytes.")
+
+    def reflink_duplicates(self, plan, workers=8):
+        """ Shares extents between each duplicate and its kept file on copy-on-write filesystems. """
+        if fcntl is None:
+            print("⚠️  Reflinks are not available on this platform; nothing was changed.")
+            return
+
+        jobs = []
+        for keeper, duplicates in plan:
+            try:
+                keeper_stat = os.stat(keeper)
+            except OSError as e:
+                print(f"⚠️  Skipping cluster of {keeper}: {e}")
+                continue
+            for file in duplicates:
+                try:
+                    st = os.stat(file)
+                except OSError as e:
+                    print(f"⚠️  Skipping {file}: {e}")
+                    continue
+                # A hardlink of the kept file already shares everything (and the ioctl rejects it)
+                if (st.st_dev, st.st_ino) != (keeper_stat.st_dev, keeper_stat.st_ino):
+                    jobs.append((keeper, file, keeper_stat.st_dev))
+
+        # Free space per filesystem before and after, since shared extents are only visible there
+        devices = {}
+        for keeper, _, dev in jobs:
+            devices.setdefault(dev, keeper)
+        free_before = {dev: self._free_bytes(path) for dev, path in devices.items()}
+
+        unsupported = set()  # Devices whose filesystem rejected the ioctl
+
+        def dedupe(job):
+            keeper, file, dev = job
+            if dev in unsupported:
+                return "unsupported", 0
+            try:
+                return "ok", dedupe_file_range(keeper, file, self.file_stats[file][0])
+            except OSError as e:
+                if e.errno in REFLINK_UNSUPPORTED:
+                    unsupported.add(dev)
+                    return "unsupported", 0
+                if e.errno in REFLINK_REJECTED:
+                    print(f"⚠️  Skipping {file}: {e.strerror}")
+                    return "rejected", 0
+                print(f"❌ Error reflinking {file}: {e}")
+                return "error", 0
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(dedupe, jobs))
+        os.sync()  # btrfs only frees the old extents when the transaction commits
+
+        shared = sum(count for status, count in results if status == "ok")
+        linked = sum(1 for status, count in results if status == "ok" and count)
+        skipped = sum(1 for status, _ in results if status == "unsupported")
+        reclaimed = sum(self._free_bytes(path) - free_before[dev] for dev, path in devices.items())
+
+        if skipped:
+            print(f"⚠️  {skipped} files were left as they are: their filesystem does not support reflinks.")
+        print(f"\n🧬 Reflinked {linked} duplicate files ({shared} bytes now shared), "
+              f"{max(reclaimed, 0)} bytes of free space reclaimed.")
+
+    def _free_bytes(self, path):
+        """ Free bytes on the filesystem holding path, as statvfs reports them. """
+        st = os.statvfs(path)
+        return st.f_bfree * st.f_frsize
+
+
+def deep_size(obj, seen):
+    """ sys.getsizeof of obj and everything it holds, skipping objects already in seen. """
+    total = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return total
+
+
+def format_duration(seconds):
+    """ 3725.4 -> '1:02:05'. """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def peak_rss():
+    """ Peak resident set size of this process in bytes, or None where getrusage is missing. """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports KiB, macOS bytes
+
+
+def dedupe_file_range(source, dest, length):
+    """ Asks the kernel to share source's extents with dest (FIDEDUPERANGE). Returns bytes deduped. """
+    # Unlike FICLONE, the kernel compares both ranges under lock, so a file that changed since
+    # verification is left alone instead of being overwritten
+    deduped = 0
+    src_fd = os.open(source, os.O_RDONLY)
+    try:
+        try:
+            dest_fd = os.open(dest, os.O_RDWR)
+        except PermissionError:
+            dest_fd = os.open(dest, os.O_RDONLY)  # Allowed for the file's owner on recent kernels
+        try:
+            offset = 0
+            while offset < length:
+                chunk = min(REFLINK_CHUNK, length - offset)
+                # struct file_dedupe_range with a single struct file_dedupe_range_info
+                request = bytearray(struct.pack("=QQHHI", offset, chunk, 1, 0, 0)
+                                    + struct.pack("=qQQiI", dest_fd, offset, 0, 0, 0))
+                fcntl.ioctl(src_fd, FIDEDUPERANGE, request)
+                _, _, done, status, _ = struct.unpack_from("=qQQiI", request, 24)
+                if status < 0:
+                    raise OSError(-status, os.strerror(-status), dest)
+                if status == FILE_DEDUPE_RANGE_DIFFERS or done == 0:
+                    break  # Contents changed since verification
+                deduped += done
+                offset += done
+        finally:
+            os.close(dest_fd)
+    finally:
+        os.close(src_fd)
+    return deduped
+
+
+def sample_digest(file_path, file_size):
+    """ MD5 of the first and last PLAN_SAMPLE bytes: a cheap check that contents did not change. """
+    hasher = hashlib.md5()
+    with open(file_path, "rb") as f:
+        hasher.update(f.read(PLAN_SAMPLE))
+        if file_size > PLAN_SAMPLE:
+            f.seek(max(PLAN_SAMPLE, file_size - PLAN_SAMPLE))
+            hasher.update(f.read(PLAN_SAMPLE))
+    return hasher.hexdigest()
+
+
+def recheck_plan_entry(entry, digest):
+    """ Confirms a planned file still holds the verified contents. Returns a reason if it does not. """
+    try:
+        st = os.stat(entry["path"])
+        if st.st_size != entry["size"]:
+            return "size changed"
+        if (st.st_mtime_ns, st.st_ino, st.st_dev) == (entry["mtime_ns"], entry["ino"], entry["dev"]):
+            # Fast path: untouched metadata, so the first and last blocks are enough
+            if sample_digest(entry["path"], st.st_size) != entry["sample"]:
+                return "contents changed"
+            return None
+        # Metadata changed: only a full hash can tell whether the contents did
+        hasher = hashlib.md5()
+        with open(entry["path"], "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                hasher.update(chunk)
+        return None if hasher.hexdigest() == digest else "contents changed"
+    except OSError as e:
+        return str(e)
+
+
+def apply_plan(plan_file, options):
+    """ Re-verifies every file in a saved plan, then runs the cleanup on what is still safe to change. """
+    with gzip.open(plan_file, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("version") != PLAN_VERSION:
+            raise ValueError("unsupported plan version")
+        clusters = [json.loads(line) for line in f]
+
+    print(f"\n🔎 Re-verifying {sum(1 + len(c['duplicates']) for c in clusters)} files from {plan_file}")
+
+    jobs = [(entry, cluster["digest"]) for cluster in clusters
+            for entry in [cluster["keep"]] + cluster["duplicates"]]
+    with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+        problems = dict(zip((entry["path"] for entry, _ in jobs),
+                            pool.map(lambda job: recheck_plan_entry(*job), jobs)))
+
+    finder = DuplicateFileFinder(header["directory"])
+    plan = []
+    for cluster in clusters:
+        keeper = cluster["keep"]["path"]
+        if problems[keeper]:
+            print(f"⚠️  Skipping cluster of {keeper}: kept file {problems[keeper]}")
+            continue
+
+        duplicates = []
+        for entry in cluster["duplicates"]:
+            if problems[entry["path"]]:
+                print(f"⚠️  Skipping {entry['path']}: {problems[entry['path']]}")
+                continue
+            duplicates.append(entry["path"])
+            finder.file_stats[entry["path"]] = (entry["size"], entry["mtime_ns"], None)
+        if duplicates:
+            finder.file_stats[keeper] = (cluster["keep"]["size"], cluster["keep"]["mtime_ns"], None)
+            plan.append((keeper, duplicates))
+
+    finder.cleanup(plan, link=options["link"], journal_file=options["journal_file"],
+                   quarantine_dir=options["quarantine_dir"], workers=options["workers"])
 
-    # Check for optional --minsize argument
-    if len(sys.argv) == 3 and sys.argv[2].startswith("--minsize="):
+
+def append_journal(quarantine_dir, records):
+    """ Appends records to the quarantine journal and flushes them to disk. """
+    with open(os.path.join(quarantine_dir, QUARANTINE_JOURNAL), "a", encoding="utf-8") as journal:
+        journal.writelines(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        journal.flush()
+        os.fsync(journal.fileno())
+
+
+def quarantined_files(quarantine_dir):
+    """ Replays the journal: returns the moves whose files are still sitting in quarantine. """
+    pending = {}
+    with open(os.path.join(quarantine_dir, QUARANTINE_JOURNAL), encoding="utf-8") as journal:
+        for line in journal:
+            record = json.loads(line)
+            if record["op"] == "move":
+                pending[record["dst"]] = record
+            else:
+                pending.pop(record["dst"], None)  # Restored or purged
+    return [move for move in pending.values() if os.path.lexists(os.path.join(quarantine_dir, move["dst"]))]
+
+
+def undo_quarantine(quarantine_dir):
+    """ Moves quarantined files back to where they came from, newest first. """
+    restored = []
+    for move in reversed(quarantined_files(quarantine_dir)):
+        if os.path.lexists(move["src"]):
+            print(f"⚠️  Not restoring {move['src']}: something else exists there now")
+            continue
+        os.makedirs(os.path.dirname(move["src"]), exist_ok=True)
+        os.rename(os.path.join(quarantine_dir, move["dst"]), move["src"])
+        restored.append({"op": "restore", "ts": time.time(), "dst": move["dst"]})
+
+    append_journal(quarantine_dir, restored)
+    print(f"↩️  Restored {len(restored)} files from {quarantine_dir}")
+
+
+def purge_quarantine(quarantine_dir, max_age_days):
+    """ Permanently deletes quarantined files older than the retention age. """
+    cutoff = time.time() - max_age_days * 86400
+    purged = []
+    freed = 0
+    for move in quarantined_files(quarantine_dir):
+        if move["ts"] < cutoff:
+            path = os.path.join(quarantine_dir, move["dst"])
+            freed += os.lstat(path).st_size
+            os.remove(path)
+            purged.append({"op": "purge", "ts": time.time(), "dst": move["dst"]})
+
+    append_journal(quarantine_dir, purged)
+    print(f"🗑 Purged {len(purged)} files older than {max_age_days:g} days, freeing {freed} bytes.")
+
+
+def run_query(db_file, query_name, limit=20):
+    """ Prints one of the ready-made DB_QUERIES against a --db results file. """
+    title, sql, columns = DB_QUERIES[query_name]
+    db = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        rows = db.execute(sql, (limit,)).fetchall()
+    finally:
+        db.close()
+
+    print(f"\n📊 {title}:")
+    print("  " + " | ".join(columns))
+    for row in rows:
+        print("  " + " | ".join(f"{value:.0f}" if isinstance(value, float) else str(value) for value in row))
+
+
+def check_bloom(bloom_file, paths):
+    """ Tells, for each file, whether its content is definitely new or possibly already known. """
+    bloom = BloomFilter.load(bloom_file)
+    finder = DuplicateFileFinder(".")
+    for path in paths:
+        file_hash = finder.get_file_hash(path)
+        if file_hash is None:
+            continue
+        if (os.path.getsize(path), file_hash) in bloom:
+            print(f"🔎 Possibly known: {path}")
+        else:
+            print(f"✨ Definitely unique: {path}")
+
+
+def read_shard(shard_file):
+    """ Streams the records of one shard in their sorted order: (size, prefix, full or None, host, path). """
+    with open(shard_file, "rb") as f:
+        magic, count, host_length = struct.unpack(SHARD_HEADER, f.read(struct.calcsize(SHARD_HEADER)))
+        if magic != SHARD_MAGIC:
+            raise ValueError(f"{shard_file} is not a ccdupe shard")
+        host = f.read(host_length).decode("utf-8")
+        record_size = struct.calcsize(SHARD_RECORD)
+        for _ in range(count):
+            size, partial, full, path_length = struct.unpack(SHARD_RECORD, f.read(record_size))
+            yield size, partial, full if any(full) else None, host, os.fsdecode(f.read(path_length))
+
+
+def merge_shards(shard_files, verify=False):
+    """ Merges sorted shards and reports content that appears on more than one host. """
+    print(f"\n🧩 Merging {len(shard_files)} shards...")
+    finder = DuplicateFileFinder(".")
+    confirmed = 0
+    candidates = 0
+
+    merged = heapq.merge(*(read_shard(shard) for shard in shard_files), key=lambda record: record[:2])
+    for (size, _), group in itertools.groupby(merged, key=lambda record: record[:2]):
+        group = list(group)
+        if len({record[3] for record in group}) < 2:
+            continue  # Same-host duplicates are each host's own business
+
+        # Hosts hash only what collides across shards; with --verify that happens right here
+        by_digest = defaultdict(list)
+        unknown = []
+        for _, partial, full, host, path in group:
+            if full is None and size <= PREFIX_BYTES:
+                full = partial  # The prefix digest already covers the whole file
+            if full is None and verify:
+                file_hash = finder.get_file_hash(path)
+                full = bytes.fromhex(file_hash) if file_hash else None
+            (by_digest[full] if full else unknown).append((host, path))
+
+        for full, members in by_digest.items():
+            if len({host for host, _ in members}) > 1:
+                confirmed += 1
+                print(f"\n🔥 Cross-host duplicates ({size} bytes, MD5: {full.hex()}):")
+                for host, path in members:
+                    print(f"  - {host}:{path}")
+        if unknown:
+            candidates += 1
+            print(f"\n❓ Needs full verification ({size} bytes, same first {PREFIX_BYTES} bytes):")
+            for host, path in [(host, path) for members in by_digest.values() for host, path in members] + unknown:
+                print(f"  - {host}:{path}")
+
+    print(f"\n✅ {confirmed} cross-host duplicate groups confirmed, {candidates} candidate groups to verify.")
+
+
+def rollback_journal(journal_file):
+    """ Undoes an interrupted or failed link batch recorded in its journal. """
+    with open(journal_file, encoding="utf-8") as journal:
+        entries = [json.loads(line) for line in journal][1:]
+
+    restored = 0
+    for entry in entries:
+        if os.path.lexists(entry["backup"]):
+            if os.path.lexists(entry["path"]) and os.path.samefile(entry["backup"], entry["path"]):
+                os.remove(entry["backup"])  # Never swapped; rename() between two links is a no-op
+            else:
+                os.replace(entry["backup"], entry["path"])  # Puts the original file back
+                restored += 1
+        if os.path.lexists(entry["tmp"]):
+            os.remove(entry["tmp"])
+
+    os.remove(journal_file)
+    print(f"↩️  Rolled back {restored} files from {journal_file}")
+
+
+def install_signal_handlers(finder):
+    """ SIGUSR1 dumps the finder's counters to stderr; SIGINT/SIGTERM ask it to stop after the current file. """
+    def dump(signum, frame):
+        # os.write rather than print: the handler may interrupt a print on the same stream
+        os.write(sys.stderr.fileno(), (json.dumps(finder.counters()) + "\n").encode())
+
+    def stop(signum, frame):
+        finder.cancelled = signum
+        # A second Ctrl-C or SIGTERM kills the run the usual way if flushing is not wanted
+        signal.signal(signum, signal.default_int_handler if signum == signal.SIGINT else signal.SIG_DFL)
+        os.write(sys.stderr.fileno(), "\n⏹  Stopping: flushing confirmed clusters (signal again to abort)\n".encode())
+
+    if hasattr(signal, "SIGUSR1"):  # Not on Windows
+        signal.signal(signal.SIGUSR1, dump)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+
+def restore_signal_handlers():
+    """ Puts Ctrl-C back to KeyboardInterrupt, e.g. for --watch and the interactive prompts. """
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def finish_interrupted(finder, result_writer, options):
+    """ Flushes everything an interrupted run has confirmed, then exits with 128 + the signal number. """
+    finder._maybe_checkpoint(force=True)
+    if options["metrics_file"]:
+        finder.write_metrics()
+    if options["db_file"]:
+        finder.save_to_database(options["db_file"])
+    if result_writer:
+        result_writer.close()
+        if options["output_file"]:
+            result_writer.stream.close()
+
+    print(f"\n⏹  Interrupted: {len(finder.verified_clusters)} confirmed clusters kept"
+          + (f", progress saved to {options['checkpoint_file']} (use --resume)" if options["checkpoint_file"] else ""))
+    sys.exit(128 + finder.cancelled)
+
+
+USAGE = ("Usage: python ccdupe.py <directory_path> [--minsize=N] "
+         "[--time-budget=SECONDS] [--checkpoint=FILE [--checkpoint-interval=SECONDS] [--resume]] "
+         "[--keep=RULE[,RULE...] [--dry-run] [--workers=N]] [--link=hard|reflink [--journal=FILE]] "
+         "[--quarantine=DIR] [--plan=FILE] [--format=ndjson|csv|json [--output=FILE]] [--db=FILE] "
+         "[--dir-report=N] [--dirs] [--watch] [--serve=SOCKET] "
+         "[--bloom=FILE [--fp-rate=P]] [--emit-shard=FILE [--host=NAME]] [--stats] "
+         "[--metrics-file=FILE [--metrics-interval=SECONDS]] [--trace=FILE] "
+         "[--profile-memory] [--progress [--progress-interval=SECONDS]] "
+         "[--error-log=FILE] [--io-timeout=SECONDS] [--io-retries=N]\n"
+         "       python ccdupe.py apply <plan_file> [--link=hard|reflink | --quarantine=DIR] [--workers=N]\n"
+         "       python ccdupe.py query <db_file> top|dirs|overlap [--limit=N]\n"
+         "       python ccdupe.py bloom-check <bloom_file> <file>...\n"
+         "       python ccdupe.py merge <shard_file>... [--verify]\n"
+         "       python ccdupe.py rollback <journal_file>\n"
+         "       python ccdupe.py undo <quarantine_dir>\n"
+         "       python ccdupe.py purge <quarantine_dir> [--older-than=DAYS]")
+
+
+def compile_keep_patterns(rules):
+    """ Compiles the regex: rules of a keep rule list: returns {rule: pattern}. """
+    return {rule: re.compile(rule[6:]) for rule in rules if rule.startswith("regex:")}
+
+
+def parse_keep_rules(value):
+    """ Parses --keep=oldest,regex:^/archive/ into a list of rules, most important first. """
+    rules = []
+    for rule in value.split(","):
+        if rule.startswith("regex:"):
+            try:
+                re.compile(rule[6:])
+            except re.error as e:
+                print(f"❌ Invalid keep pattern {rule[6:]!r}: {e}")
+                sys.exit(1)
+        elif rule not in KEEP_RULES and not rule.startswith("root:"):
+            print(f"❌ Unknown keep rule: {rule} (use oldest, newest, shortest-path, root:PATH or regex:PATTERN)")
+            sys.exit(1)
+        rules.append(rule)
+    return rules
+
+
+def parse_options(args):
+    """ Parses the optional --name=value arguments that follow the directory. """
+    options = {
+        "min_size": 0,
+        "checkpoint_file": None,
+        "checkpoint_interval": 60,
+        "resume": False,
+        "time_budget": None,
+        "keep": None,
+        "dry_run": False,
+        "workers": 8,
+        "link": None,
+        "journal_file": "ccdupe-link.journal",
+        "plan_file": None,
+        "quarantine_dir": None,
+        "older_than": 30,
+        "format": None,
+        "output_file": None,
+        "db_file": None,
+        "limit": 20,
+        "dir_report": None,
+        "dirs": False,
+        "watch": False,
+        "socket_path": None,
+        "bloom_file": None,
+        "fp_rate": 0.01,
+        "shard_file": None,
+        "host": socket.gethostname(),
+        "stats": False,
+        "metrics_file": None,
+        "metrics_interval": 15,
+        "trace_file": None,
+        "profile_memory": False,
+        "progress": False,
+        "progress_interval": None,
+        "error_log": None,
+        "io_timeout": None,
+        "io_retries": 3,
+    }
+
+    for arg in args:
+        name, _, value = arg.partition("=")
         try:
-            min_size = int(sys.argv[2].split("=")[1])
+            if name == "--minsize":
+                options["min_size"] = int(value)
+            elif name == "--checkpoint" and value:
+                options["checkpoint_file"] = value
+            elif name == "--checkpoint-interval":
+                options["checkpoint_interval"] = float(value)
+            elif arg == "--resume":
+                options["resume"] = True
+            elif name == "--time-budget":
+                options["time_budget"] = float(value)
+            elif name == "--keep" and value:
+                options["keep"] = parse_keep_rules(value)
+            elif arg == "--dry-run":
+                options["dry_run"] = True
+            elif name == "--workers":
+                options["workers"] = max(1, int(value))
+            elif name == "--link" and value in ("hard", "reflink"):
+                options["link"] = value
+            elif name == "--journal" and value:
+                options["journal_file"] = value
+            elif name == "--plan" and value:
+                options["plan_file"] = value
+            elif name == "--quarantine" and value:
+                options["quarantine_dir"] = value
+            elif name == "--older-than":
+                options["older_than"] = float(value)
+            elif name == "--format" and value in ("ndjson", "csv", "json"):
+                options["format"] = value
+            elif name == "--output" and value:
+                options["output_file"] = value
+            elif name == "--db" and value:
+                options["db_file"] = value
+            elif name == "--limit":
+                options["limit"] = int(value)
+            elif name == "--dir-report":
+                options["dir_report"] = int(value)
+            elif arg == "--dirs":
+                options["dirs"] = True
+            elif arg == "--watch":
+                options["watch"] = True
+            elif name == "--serve" and value:
+                options["socket_path"] = value
+            elif name == "--bloom" and value:
+                options["bloom_file"] = value
+            elif name == "--emit-shard" and value:
+                options["shard_file"] = value
+            elif name == "--host" and value:
+                options["host"] = value
+            elif arg == "--stats":
+                options["stats"] = True
+            elif name == "--metrics-file" and value:
+                options["metrics_file"] = value
+            elif name == "--metrics-interval":
+                options["metrics_interval"] = float(value)
+            elif name == "--trace" and value:
+                options["trace_file"] = value
+            elif arg == "--profile-memory":
+                options["profile_memory"] = True
+            elif arg == "--progress":
+                options["progress"] = True
+            elif name == "--progress-interval":
+                options["progress_interval"] = float(value)
+            elif name == "--error-log" and value:
+                options["error_log"] = value
+            elif name == "--io-timeout":
+                options["io_timeout"] = float(value)
+                if options["io_timeout"] <= 0:
+                    raise ValueError
+            elif name == "--io-retries":
+                options["io_retries"] = max(0, int(value))
+            elif name == "--fp-rate":
+                options["fp_rate"] = float(value)
+                if not 0 < options["fp_rate"] < 1:
+                    raise ValueError
+            else:
+                print(f"❌ Unknown option: {arg}")
+                print(USAGE)
+                sys.exit(1)
         except ValueError:
-            print("❌ Invalid minsize value. Please enter a valid number.")
+            print(f"❌ Invalid {name[2:]} value. Please enter a valid number.")
+            sys.exit(1)
+
+    if options["dry_run"] and not (options["keep"] or options["link"] or options["quarantine_dir"]):
+        print("❌ --dry-run needs --keep=RULE to know which file of each cluster to keep.")
+        sys.exit(1)
+
+    if options["dirs"] and options["min_size"]:
+        print("❌ --dirs compares whole directories, so it cannot be combined with --minsize.")
+        sys.exit(1)
+
+    if options["resume"] and not options["checkpoint_file"]:
+        print("❌ --resume needs --checkpoint=FILE to know where to resume from.")
+        sys.exit(1)
+
+    return options
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(USAGE)
+        sys.exit(1)
+
+    if sys.argv[1] in ("apply", "query", "bloom-check", "merge", "rollback", "undo", "purge") \
+            and not os.path.isdir(sys.argv[1]):
+        if len(sys.argv) < 3:
+            print(USAGE)
             sys.exit(1)
 
+        if sys.argv[1] == "rollback":
+            rollback_journal(sys.argv[2])
+        elif sys.argv[1] == "query":
+            if len(sys.argv) < 4 or sys.argv[3] not in DB_QUERIES:
+                print(f"❌ Choose a query: {', '.join(DB_QUERIES)}")
+                sys.exit(1)
+            run_query(sys.argv[2], sys.argv[3], parse_options(sys.argv[4:])["limit"])
+        elif sys.argv[1] == "bloom-check":
+            try:
+                check_bloom(sys.argv[2], sys.argv[3:])
+            except (OSError, ValueError, struct.error) as e:
+                print(f"❌ Cannot read Bloom filter {sys.argv[2]}: {e}")
+                sys.exit(1)
+        elif sys.argv[1] == "merge":
+            shards = [arg for arg in sys.argv[2:] if arg != "--verify"]
+            try:
+                merge_shards(shards, verify="--verify" in sys.argv[2:])
+            except (OSError, ValueError, struct.error) as e:
+                print(f"❌ Cannot merge shards: {e}")
+                sys.exit(1)
+        elif sys.argv[1] == "undo":
+            undo_quarantine(sys.argv[2])
+        elif sys.argv[1] == "purge":
+            purge_quarantine(sys.argv[2], parse_options(sys.argv[3:])["older_than"])
+        else:
+            try:
+                apply_plan(sys.argv[2], parse_options(sys.argv[3:]))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"❌ Cannot apply plan {sys.argv[2]}: {e}")
+                sys.exit(1)
+        sys.exit(0)
+
+    directory = sys.argv[1]
+    options = parse_options(sys.argv[2:])
+    min_size = options["min_size"]
+
     if not os.path.isdir(directory):
         print(f"❌ Invalid directory: {directory}")
         sys.exit(1)
 
+    result_writer = None
+    if options["format"]:
+        if options["output_file"]:
+            stream = open(options["output_file"], "w", encoding="utf-8", newline="", buffering=1024 * 1024)
+        else:
+            stream = sys.stdout
+            sys.stdout = sys.stderr  # Keep the progress messages out of the machine-readable stream
+        result_writer = ResultWriter(options["format"], stream)
+
+    tracer = None
+    if options["trace_file"]:
+        tracer = TraceRecorder()
+        atexit.register(tracer.save, options["trace_file"])  # Also covers the early exits and Ctrl-C
+
+    memory = MemoryProfiler() if options["profile_memory"] else None  # Started before anything is indexed
+    # Every path the walk skips, one per line: errno, message, path
+    error_log = open(options["error_log"], "w", encoding="utf-8", errors="surrogateescape") \
+        if options["error_log"] else None
+
     print(f"\n📂 Scanning directory: {directory} (Ignoring files smaller than {min_size} bytes)")
 
-    finder = DuplicateFileFinder(directory, min_size)
+    finder = DuplicateFileFinder(directory, min_size,
+                                 checkpoint_file=options["checkpoint_file"],
+                                 checkpoint_interval=options["checkpoint_interval"],
+                                 time_budget=options["time_budget"],
+                                 result_writer=result_writer,
+                                 stats=ScanStats() if options["stats"] or options["metrics_file"] else None,
+                                 metrics_file=options["metrics_file"],
+                                 metrics_interval=options["metrics_interval"],
+                                 tracer=tracer,
+                                 onerror=(lambda path, e: error_log.write(f"{e.errno}\t{e.strerror}\t{path}\n"))
+                                 if error_log else None,
+                                 reader=ReadExecutor(options["io_timeout"], options["io_retries"]))
+
+    if options["resume"] and os.path.exists(options["checkpoint_file"]):
+        try:
+            finder.load_checkpoint()
+        except (OSError, ValueError, KeyError) as e:
+            print(f"❌ Cannot resume from {options['checkpoint_file']}: {e}")
+            sys.exit(1)
+        if memory:
+            memory.snapshot("resume")
+
+    install_signal_handlers(finder)
+    progress = ProgressReporter(finder, options["progress_interval"]) if options["progress"] else None
     finder.scan_directory()
+    if error_log:
+        error_log.close()
+    if memory:
+        memory.snapshot("scan")
+    if progress and (finder.cancelled or options["shard_file"] or options["bloom_file"] or options["socket_path"]):
+        progress.stop()  # These modes end after the walk
+    if finder.cancelled:
+        finish_interrupted(finder, result_writer, options)
+    if options["shard_file"] or options["bloom_file"] or options["socket_path"]:
+        restore_signal_handlers()
+
+    if options["shard_file"]:
+        finder.emit_shard(options["shard_file"], options["host"])
+        sys.exit(0)
+
+    if options["bloom_file"]:
+        finder.build_bloom_filter(options["bloom_file"], options["fp_rate"])
+        sys.exit(0)
+
+    if options["socket_path"]:
+        # The daemon only needs every file's digest, not a full duplicate pass
+        finder.serve(options["socket_path"])
+        sys.exit(0)
+
+    if options["dirs"]:
+        finder.find_duplicate_directories()
+        if memory:
+            memory.snapshot("dirs")
     finder.find_true_duplicates()
+    if progress:
+        progress.stop()
+    if finder.cancelled:
+        finish_interrupted(finder, result_writer, options)
+    restore_signal_handlers()
+    if memory:
+        memory.snapshot("duplicates")
+        memory.report(finder)
+
+    if options["stats"]:
+        finder.stats.report()
+    if options["metrics_file"]:
+        finder.write_metrics(complete=True)
+
+    if options["db_file"]:
+        finder.save_to_database(options["db_file"])
+
+    if options["dir_report"]:
+        finder.directory_report(options["keep"] or [], options["dir_report"])
+
+    if options["watch"]:
+        finder.watch()
+    elif options["keep"] or options["link"] or options["quarantine_dir"] or options["plan_file"]:
+        # Linking keeps every path, so without keep rules the first file walked is the link target
+        plan = finder.plan_cleanup(options["keep"] or [])
+        if options["plan_file"]:
+            finder.write_plan(plan, options["plan_file"], workers=options["workers"])
+        elif options["dry_run"]:
+            action = "link" if options["link"] else "move" if options["quarantine_dir"] else "delete"
+            finder.print_plan(plan, action=action)
+        else:
+            finder.cleanup(plan, link=options["link"], journal_file=options["journal_file"],
+                           quarantine_dir=options["quarantine_dir"], workers=options["workers"])
+    elif not result_writer:
+        finder.delete_interactively()
+
+    if result_writer:
+        result_writer.close()
+        if options["output_file"]:
+            result_writer.stream.close()
 
 
 """
@@ -149,4 +2769,98 @@ if __name__ == "__main__":
 """
 Running Script:
     python3 ccdupe_6.py test_data
+
+    Checkpointing a long scan every 5 minutes, then resuming it after an interruption
+        python3 ccdupe_6.py /mnt/share --checkpoint=share.ckpt --checkpoint-interval=300
+        python3 ccdupe_6.py /mnt/share --checkpoint=share.ckpt --resume
+
+    Confirming the most valuable duplicates first within a 2 hour maintenance window
+        python3 ccdupe_6.py /mnt/share --time-budget=7200
+
+    Deleting duplicates without prompts: keep the copy under /mnt/share/master, else the oldest
+        python3 ccdupe_6.py /mnt/share --keep=root:/mnt/share/master,oldest --dry-run
+        python3 ccdupe_6.py /mnt/share --keep=root:/mnt/share/master,oldest
+
+    Replacing duplicates with hardlinks to the oldest copy (each swap is atomic)
+        python3 ccdupe_6.py /mnt/share --link=hard --keep=oldest --journal=share.journal
+        python3 ccdupe_6.py rollback share.journal   # only needed if a link run was interrupted
+
+    Sharing storage between duplicates on btrfs/XFS while every file stays independently writable
+        python3 ccdupe_6.py /mnt/share --link=reflink
+
+    Planning overnight and applying later: 'apply' re-checks every file before changing anything
+        python3 ccdupe_6.py /mnt/share --keep=oldest --plan=share.plan
+        python3 ccdupe_6.py apply share.plan --link=hard --workers=32
+
+    Moving duplicates into a quarantine on the same filesystem, then undoing or purging later
+        (a quarantine carries a .ccdupe-quarantine marker and is never scanned, but outside the tree is clearer)
+        python3 ccdupe_6.py /mnt/share/data --keep=oldest --quarantine=/mnt/share/.quarantine
+        python3 ccdupe_6.py undo /mnt/share/.quarantine
+        python3 ccdupe_6.py purge /mnt/share/.quarantine --older-than=30
+
+    Streaming each cluster as soon as it is confirmed, for other tools to consume
+        python3 ccdupe_6.py /mnt/share --format=ndjson | jq .reclaimable_bytes
+        python3 ccdupe_6.py /mnt/share --format=csv --output=duplicates.csv
+        (a cluster reopened by a late file is withdrawn first: "withdrawn": true, negative reclaimable_bytes)
+        python3 ccdupe_6.py /mnt/share --format=ndjson | jq -s 'map(.reclaimable_bytes) | add'
+
+    Saving results to SQLite, then asking where the duplicate bytes are
+        python3 ccdupe_6.py /mnt/share --db=share.db --format=ndjson --output=/dev/null
+        python3 ccdupe_6.py query share.db top --limit=10
+        python3 ccdupe_6.py query share.db dirs
+        python3 ccdupe_6.py query share.db overlap
+
+    Showing the 10 subtrees that would free the most space if their duplicates were removed
+        python3 ccdupe_6.py /mnt/share --keep=oldest --dir-report=10 --dry-run
+
+    Reporting copied directory trees once instead of file by file
+        python3 ccdupe_6.py /mnt/backups --dirs
+
+    Indexing once, then reporting new duplicates within seconds of them being written (Linux)
+        python3 ccdupe_6.py /srv/uploads --watch
+
+    Answering "is this upload a known duplicate?" over a Unix socket, with the index kept on disk
+        python3 ccdupe_6.py /srv/archive --serve=/run/ccdupe.sock --checkpoint=archive.idx --resume
+        echo "PATH /tmp/upload.bin" | nc -NU /run/ccdupe.sock
+        echo "DIGEST 1048576 9e107d9d372bb6826bd81d3542a419d6" | nc -NU /run/ccdupe.sock
+
+    Building a compact filter of every file's content, then pre-screening uploads without the index
+        python3 ccdupe_6.py /srv/archive --bloom=archive.bloom --fp-rate=0.001
+        python3 ccdupe_6.py bloom-check archive.bloom /tmp/upload1.bin /tmp/upload2.bin
+
+    Finding duplicates across servers: each host writes a shard, one machine merges them
+        python3 ccdupe_6.py /srv/data --emit-shard=fs01.shard        # on every file server
+        python3 ccdupe_6.py merge fs*.shard                          # candidates across hosts
+        python3 ccdupe_6.py merge fs*.shard --verify                 # hash candidates reachable from here
+
+    Trying it locally, with two processes standing in for two hosts
+        python3 ccdupe_6.py test_data --emit-shard=a.shard --host=a & python3 ccdupe_6.py testdir --emit-shard=b.shard --host=b; wait
+        python3 ccdupe_6.py merge a.shard b.shard --verify
+
+    Seeing where the time goes: per-stage timings, I/O counters and the candidate funnel
+        python3 ccdupe_6.py /mnt/share --stats --format=ndjson --output=/dev/null
+
+    Nightly cron run exporting metrics for node_exporter's textfile collector
+        python3 ccdupe_6.py /mnt/share --keep=oldest --plan=share.plan \\
+            --metrics-file=/var/lib/node_exporter/textfile/ccdupe.prom --metrics-interval=30
+
+    Recording a trace of the walk, every hash and every verification, to open in https://ui.perfetto.dev
+        python3 ccdupe_6.py /mnt/share --trace=share-trace.json --format=ndjson --output=/dev/null
+
+    Watching a long scan: a live line on a terminal, a log line every 60 seconds under cron or nohup
+        python3 ccdupe_6.py /mnt/share --progress --format=ndjson --output=duplicates.ndjson
+        nohup python3 ccdupe_6.py /mnt/share --progress --progress-interval=60 --keep=oldest --plan=share.plan &
+
+    Scanning a tree full of unreadable entries, keeping a full list of what was skipped
+        python3 ccdupe_6.py /home --error-log=skipped.tsv --format=ndjson --output=duplicates.ndjson
+
+    Scanning a flaky NFS mount: give up on a read stuck for 30s, retry EIO/EAGAIN/ESTALE up to 5 times
+        python3 ccdupe_6.py /mnt/nfs --io-timeout=30 --io-retries=5 --format=ndjson --output=duplicates.ndjson
+
+    Peeking at a running scan, then stopping it without losing what it confirmed so far
+        kill -USR1 $(pgrep -f ccdupe_6.py)    # one line of JSON counters on stderr
+        kill -TERM $(pgrep -f ccdupe_6.py)    # or Ctrl-C; clusters are flushed to --output and --checkpoint
+
+    Finding out which structure is eating the memory on a big tree
+        python3 ccdupe_6.py /mnt/share --profile-memory --format=ndjson --output=/dev/null
 """
\ No newline at end of file
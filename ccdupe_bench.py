@@ -0,0 +1,286 @@
+import os
+import sys
+import io
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import contextlib
+
+from ccdupe_6 import DuplicateFileFinder, MemoryProfiler, ScanStats
+
+"""
+Benchmark harness for ccdupe_6.py.
+
+test_data only has 21 tiny files, which says nothing about how the finder behaves on real trees.
+This script generates deterministic synthetic trees, one per profile, runs DuplicateFileFinder
+on each and times its stages separately (see ScanStats):
+
+    scan   -> walking the tree and grouping files by size
+    prefix -> MD5 of the first block, splitting same-size groups
+    hash   -> MD5 of every remaining candidate file
+    verify -> byte-by-byte comparison of same-hash files
+
+Results are written as JSON so two runs can be compared for regressions. With --profile-memory
+each profile also records traced memory at the stage boundaries and the estimated bytes per file of
+size_map, hash_map and verified_duplicates (see MemoryProfiler); tracemalloc slows everything down,
+so compare timings only between runs made in the same mode. --max-memory-growth=PCT turns --compare
+into a gate that exits with status 1 when any of those numbers grew by more than PCT percent.
+"""
+
+STAGES = ScanStats.STAGES + ("total",)
+
+# name -> (description, generator); generators take (root, rng, scale)
+PROFILES = {}
+
+
+def profile(description):
+    """ Registers a tree generator under its function name. """
+    def register(generator):
+        PROFILES[generator.__name__] = (description, generator)
+        return generator
+    return register
+
+
+def random_bytes(rng, size):
+    """ size reproducible random bytes (random.randbytes needs Python 3.9). """
+    return rng.getrandbits(size * 8).to_bytes(size, "little") if size else b""
+
+
+def write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+@profile("many tiny files (0-64 bytes), lots of size collisions")
+def tiny(root, rng, scale):
+    for i in range(5000 * scale):
+        folder = os.path.join(root, f"d{i % 50}")
+        os.makedirs(folder, exist_ok=True)
+        write_file(os.path.join(folder, f"f{i}"), random_bytes(rng, rng.randint(0, 64)))
+
+
+@profile("a few huge files, one identical pair")
+def huge(root, rng, scale):
+    block = random_bytes(rng, 1024 * 1024)
+    size = 32 * scale  # MiB per file
+    for name in ("a", "b", "c"):
+        with open(os.path.join(root, name), "wb") as f:
+            for _ in range(size):
+                f.write(block)
+    # Same size as the others, differs only in its very last byte
+    with open(os.path.join(root, "d"), "wb") as f:
+        for _ in range(size - 1):
+            f.write(block)
+        f.write(block[:-1] + bytes([block[-1] ^ 0xFF]))
+
+
+@profile("many same-size files with different content (hash everything, verify nothing)")
+def same_size(root, rng, scale):
+    for i in range(2000 * scale):
+        write_file(os.path.join(root, f"f{i}"), random_bytes(rng, 4096))
+
+
+@profile("deep directory chain")
+def deep(root, rng, scale):
+    folder = root
+    for level in range(100 * scale):
+        folder = os.path.join(folder, f"l{level}")
+        os.makedirs(folder)
+        for i in range(5):
+            write_file(os.path.join(folder, f"f{i}"), random_bytes(rng, rng.randint(100, 2000)))
+
+
+@profile("one wide directory")
+def wide(root, rng, scale):
+    for i in range(10000 * scale):
+        write_file(os.path.join(root, f"f{i:06d}"), random_bytes(rng, rng.randint(100, 4000)))
+
+
+@profile("files with several hardlinks each")
+def hardlinks(root, rng, scale):
+    for i in range(500 * scale):
+        original = os.path.join(root, f"f{i}")
+        write_file(original, random_bytes(rng, rng.randint(1000, 8000)))
+        for link in range(3):
+            os.link(original, os.path.join(root, f"f{i}.link{link}"))
+
+
+@profile("large clusters of identical files")
+def clusters(root, rng, scale):
+    for cluster in range(50 * scale):
+        data = random_bytes(rng, 16 * 1024)
+        folder = os.path.join(root, f"c{cluster}")
+        os.makedirs(folder)
+        for copy in range(40):
+            write_file(os.path.join(folder, f"copy{copy}"), data)
+
+
+def tree_stats(root):
+    """ Counts the generated files and their bytes. """
+    files = 0
+    size = 0
+    for folder, _, names in os.walk(root):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(folder, name))
+    return files, size
+
+
+def run_profile(name, base, seed, scale, profile_memory=False):
+    """ Generates one profile's tree and times each stage of the finder on it. """
+    description, generator = PROFILES[name]
+    root = os.path.join(base, name)
+    os.makedirs(root)
+    generator(root, random.Random(seed), scale)
+    files, size = tree_stats(root)
+
+    memory = MemoryProfiler() if profile_memory else None
+    finder = DuplicateFileFinder(root, stats=ScanStats())
+    with contextlib.redirect_stdout(io.StringIO()):  # The finder's own messages are not the point here
+        started = time.perf_counter()
+        finder.scan_directory()
+        if memory:
+            memory.snapshot("scan")
+        finder.find_true_duplicates()
+        finished = time.perf_counter()
+
+    stats = finder.stats.as_dict()
+    result = {
+        "description": description,
+        "files": files,
+        "bytes": size,
+        "clusters": len(finder.verified_clusters),
+    }
+    for stage in STAGES[:-1]:
+        result[f"{stage}_seconds"] = stats["stages"][stage]["wall_seconds"]
+    result["total_seconds"] = round(finished - started, 6)
+    result["bytes_read"] = stats["bytes_read"]
+    result["funnel"] = stats["funnel"]
+    if memory:
+        memory.snapshot("duplicates")
+        result["memory"] = memory.as_dict(finder)
+        memory.stop()
+    return result
+
+
+def memory_figures(result):
+    """ The memory numbers of one profile that the regression gate watches, by name. """
+    memory = result["memory"]
+    figures = {f"{name} bytes/file": size["bytes_per_file"] for name, size in memory["structures"].items()}
+    figures["traced peak"] = max(stage["traced_peak_bytes"] for stage in memory["stages"].values())
+    return figures
+
+
+def compare(results, baseline_file, max_memory_growth=None):
+    """ Prints how each stage moved against an earlier results file; returns the memory regressions. """
+    with open(baseline_file, encoding="utf-8") as f:
+        baseline = json.load(f)["profiles"]
+    regressions = []
+
+    print(f"\n📈 Compared with {baseline_file}:")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        changes = []
+        for stage in STAGES:
+            if f"{stage}_seconds" not in baseline[name]:
+                continue
+            old = baseline[name][f"{stage}_seconds"]
+            new = result[f"{stage}_seconds"]
+            changes.append(f"{stage} {(new - old) / old * 100:+.0f}%" if old else f"{stage} n/a")
+        print(f"  {name:<10} " + ", ".join(changes))
+
+        if "memory" not in result or "memory" not in baseline[name]:
+            continue
+        old_figures = memory_figures(baseline[name])
+        changes = []
+        for figure, new in memory_figures(result).items():
+            old = old_figures.get(figure)
+            if not old:
+                continue
+            growth = (new - old) / old * 100
+            changes.append(f"{figure} {growth:+.0f}%")
+            if max_memory_growth is not None and growth > max_memory_growth:
+                regressions.append(f"{name}: {figure} {old} -> {new} ({growth:+.0f}%)")
+        print(f"  {'':<10} " + ", ".join(changes))
+    return regressions
+
+
+if __name__ == "__main__":
+    options = {"output": "bench_results.json", "seed": 42, "scale": 1, "compare": None, "root": None,
+               "profile_memory": False, "max_memory_growth": None}
+    names = []
+
+    for arg in sys.argv[1:]:
+        name, _, value = arg.partition("=")
+        if name in ("--output", "--compare", "--root") and value:
+            options[name[2:]] = value
+        elif name in ("--seed", "--scale"):
+            try:
+                options[name[2:]] = int(value)
+            except ValueError:
+                print(f"❌ Invalid {name[2:]} value. Please enter a valid number.")
+                sys.exit(1)
+        elif arg == "--profile-memory":
+            options["profile_memory"] = True
+        elif name == "--max-memory-growth":
+            try:
+                options["max_memory_growth"] = float(value)
+            except ValueError:
+                print("❌ Invalid max-memory-growth value. Please enter a valid number.")
+                sys.exit(1)
+        elif arg in PROFILES:
+            names.append(arg)
+        else:
+            print("Usage: python ccdupe_bench.py [profile...] [--scale=N] [--seed=N] "
+                  "[--output=FILE] [--compare=FILE [--max-memory-growth=PCT]] [--root=DIR] [--profile-memory]")
+            print(f"Profiles: {', '.join(PROFILES)}")
+            sys.exit(1)
+
+    base = tempfile.mkdtemp(prefix="ccdupe-bench-", dir=options["root"])
+    results = {}
+    try:
+        for name in names or list(PROFILES):
+            print(f"⏱ {name}: {PROFILES[name][0]}")
+            results[name] = run_profile(name, base, options["seed"], options["scale"], options["profile_memory"])
+            r = results[name]
+            print(f"   {r['files']} files, {r['bytes']} bytes -> "
+                  + ", ".join(f"{stage} {r[stage + '_seconds']:.3f}s" for stage in STAGES))
+    finally:
+        shutil.rmtree(base)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": options["seed"],
+        "scale": options["scale"],
+        "profile_memory": options["profile_memory"],
+        "profiles": results,
+    }
+    with open(options["output"], "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Results written to {options['output']}")
+
+    if options["compare"]:
+        regressions = compare(results, options["compare"], options["max_memory_growth"])
+        if regressions:
+            print(f"\n❌ Memory grew by more than {options['max_memory_growth']:g}%:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+
+"""
+Running Script:
+    All profiles at the default size
+        python3 ccdupe_bench.py
+
+    A few profiles, ten times bigger, compared against an earlier run
+        python3 ccdupe_bench.py tiny clusters --scale=10 --output=new.json --compare=bench_results.json
+
+    Memory regression gate for CI: fails if any structure's bytes per file grew by more than 10%
+        python3 ccdupe_bench.py --profile-memory --output=memory_baseline.json
+        python3 ccdupe_bench.py --profile-memory --output=new.json --compare=memory_baseline.json --max-memory-growth=10
+"""
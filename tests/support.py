@@ -0,0 +1,65 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ccdupe_6 import DuplicateFileFinder  # noqa: E402
+
+"""
+Shared fixtures for the behaviour tests of ccdupe_6.py: a throwaway tree with one cluster of
+duplicates, and helpers to write, read and change its files.
+
+    python -m pytest -q tests
+"""
+
+CONTENT = b"duplicate contents\n" * 1000
+
+
+class TreeTestCase(unittest.TestCase):
+    """ A tree with a kept file, two copies of it and one unrelated file, removed after each test. """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, "tree")
+        self.keeper = self.write("a/keep.bin", CONTENT)
+        self.duplicates = [self.write("b/copy1.bin", CONTENT), self.write("c/copy2.bin", CONTENT)]
+        self.other = self.write("a/other.bin", b"something else")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def finder(self, **kwargs):
+        """ A finder that has scanned the tree and verified its duplicates. """
+        finder = DuplicateFileFinder(self.root, **kwargs)
+        finder.scan_directory()
+        finder.find_true_duplicates()
+        return finder
+
+    def find(self):
+        """ A verified finder plus its plan, with the kept file chosen by its folder. """
+        finder = self.finder()
+        plan = finder.plan_cleanup([f"root:{os.path.dirname(self.keeper)}"])
+        self.assertEqual(plan, [(self.keeper, sorted(self.duplicates))])
+        return finder, plan
+
+    def change(self, path):
+        """ Rewrites a file with other contents of the same size and a new mtime. """
+        data = bytearray(self.read(path))
+        data[len(data) // 2] ^= 0xFF
+        with open(path, "wb") as f:
+            f.write(data)
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
@@ -0,0 +1,83 @@
+import io
+import json
+import os
+import unittest
+
+from support import CONTENT, TreeTestCase
+
+from ccdupe_6 import CHANGE_RETRIES, DuplicateFileFinder, ResultWriter
+
+"""
+Files that change while they are read are re-queued until they hold still, and nothing matched
+against a stale read is ever recorded.
+"""
+
+
+def touch(path):
+    """ Moves a file's mtime forward without changing its contents. """
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+class TouchingFinder(DuplicateFileFinder):
+    """ Changes a file right after it is hashed, or right before the nth byte-by-byte comparison. """
+
+    def __init__(self, directory, hashed=None, touches=1, compared=None, before_compare=None, **kwargs):
+        super().__init__(directory, **kwargs)
+        self.hashed = hashed
+        self.touches = touches
+        self.compared = compared
+        self.before_compare = before_compare
+        self.compares = 0
+
+    def _read_hash(self, file_path):
+        file_hash, st = super()._read_hash(file_path)
+        if file_path == self.hashed and self.touches:
+            self.touches -= 1
+            touch(file_path)
+            st = os.stat(file_path)
+        return file_hash, st
+
+    def _compare(self, file1, file2):
+        self.compares += 1
+        if self.compares == self.before_compare:
+            touch(self.compared)
+        return super()._compare(file1, file2)
+
+
+class ChangeTest(TreeTestCase):
+    def run_finder(self, **kwargs):
+        out = io.StringIO()
+        writer = ResultWriter("ndjson", out)
+        finder = TouchingFinder(self.root, result_writer=writer, **kwargs)
+        finder.scan_directory()
+        finder.find_true_duplicates()
+        writer.close()
+        return finder, [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def clusters(self, finder):
+        return [sorted(files) for _, _, files in finder.verified_clusters]
+
+    def test_file_changed_while_hashed_is_hashed_again(self):
+        finder, records = self.run_finder(hashed=self.duplicates[0])
+        self.assertEqual(self.clusters(finder), [sorted([self.keeper] + self.duplicates)])
+        self.assertEqual(finder.unstable, [])
+        # Streamed without it first, then withdrawn and streamed again once it joined
+        self.assertEqual(sum(record["reclaimable_bytes"] for record in records), 2 * len(CONTENT))
+
+    def test_file_that_never_holds_still_is_left_out(self):
+        finder, records = self.run_finder(hashed=self.duplicates[0], touches=CHANGE_RETRIES + 1)
+        self.assertEqual(finder.unstable, [self.duplicates[0]])
+        self.assertEqual(self.clusters(finder), [sorted([self.keeper, self.duplicates[1]])])
+        self.assertNotIn(self.duplicates[0], finder.file_stats)
+
+    def test_change_during_verification_records_nothing_stale(self):
+        # The representative matches copy1, then changes before it is compared with copy2
+        finder, records = self.run_finder(compared=self.keeper, before_compare=2)
+        self.assertEqual(self.clusters(finder), [sorted([self.keeper] + self.duplicates)])
+        self.assertEqual(len(records), 1)
+        self.assertFalse(records[0].get("withdrawn"))
+
+
+if __name__ == "__main__":
+    unittest.main()
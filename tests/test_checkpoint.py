@@ -0,0 +1,79 @@
+import os
+import shutil
+import unittest
+
+from support import CONTENT, TreeTestCase
+
+from ccdupe_6 import DuplicateFileFinder, ScanStats
+
+"""
+A resumed scan must trust only what did not change since its checkpoint, and report the same
+numbers as a scan that never stopped.
+"""
+
+
+class CheckpointTest(TreeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.checkpoint = os.path.join(self.tmp.name, "scan.ckpt")
+
+    def first_run(self):
+        return self.finder(checkpoint_file=self.checkpoint)
+
+    def resume(self, **kwargs):
+        finder = DuplicateFileFinder(self.root, checkpoint_file=self.checkpoint, **kwargs)
+        finder.load_checkpoint()
+        finder.scan_directory()
+        finder.find_true_duplicates()
+        return finder
+
+    def clusters(self, finder):
+        return [sorted(files) for _, _, files in finder.verified_clusters]
+
+    def test_resumed_funnel_matches_a_full_run(self):
+        full = self.finder(stats=ScanStats())
+        self.first_run()
+
+        resumed = self.resume(stats=ScanStats())
+        self.assertEqual(resumed.stats.funnel, full.stats.funnel)
+        self.assertEqual(resumed.stats.funnel["files"], 4)
+
+    def test_unchanged_tree_is_not_read_again(self):
+        self.first_run()
+        resumed = self.resume()
+        self.assertEqual(self.clusters(resumed), [sorted([self.keeper] + self.duplicates)])
+        self.assertEqual(resumed.hashed_bytes, 0)
+
+    def test_changed_file_reopens_its_group(self):
+        self.first_run()
+        self.change(self.duplicates[0])
+
+        resumed = self.resume()
+        self.assertEqual(self.clusters(resumed), [sorted([self.keeper, self.duplicates[1]])])
+
+    def test_deleted_file_leaves_its_cluster(self):
+        self.first_run()
+        os.remove(self.duplicates[0])
+
+        resumed = self.resume()
+        self.assertEqual(self.clusters(resumed), [sorted([self.keeper, self.duplicates[1]])])
+        self.assertNotIn(self.duplicates[0], resumed.file_stats)
+
+    def test_new_file_in_a_walked_directory_is_found(self):
+        self.first_run()
+        copy = self.write("b/copy3.bin", CONTENT)
+
+        resumed = self.resume()
+        self.assertEqual(self.clusters(resumed), [sorted([self.keeper, copy] + self.duplicates)])
+
+    def test_deleted_directory_is_not_a_walk_error(self):
+        self.first_run()
+        shutil.rmtree(os.path.dirname(self.duplicates[1]))
+
+        resumed = self.resume()
+        self.assertEqual(dict(resumed.walk_errors), {})
+        self.assertEqual(self.clusters(resumed), [sorted([self.keeper, self.duplicates[0]])])
+
+
+if __name__ == "__main__":
+    unittest.main()
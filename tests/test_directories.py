@@ -0,0 +1,64 @@
+import os
+import unittest
+
+from support import CONTENT, TreeTestCase
+
+from ccdupe_6 import DuplicateFileFinder
+
+"""
+Copied directory trees are reported once, at their outermost level, and only when every file in
+them is byte-identical; their files then leave the file-level pass.
+"""
+
+
+class DirectoryTest(TreeTestCase):
+    def setUp(self):
+        super().setUp()
+        for copy in ("x", "y"):
+            self.write(f"{copy}/docs/one.txt", b"one\n")
+            self.write(f"{copy}/docs/deep/two.txt", b"two two\n")
+            self.write(f"{copy}/three.bin", CONTENT)
+
+    def scan(self, **kwargs):
+        finder = DuplicateFileFinder(self.root, **kwargs)
+        finder.scan_directory()
+        return finder
+
+    def walked(self, finder):
+        return {file for files in finder.size_map.values() for file in files}
+
+    def test_outermost_copy_is_reported_once(self):
+        finder = self.scan()
+        reported = finder.find_duplicate_directories()
+        self.assertEqual(reported, [[os.path.join(self.root, "x"), os.path.join(self.root, "y")]])
+
+        # The copy's files leave the file-level pass; the original's stay
+        walked = self.walked(finder)
+        self.assertNotIn(os.path.join(self.root, "y", "three.bin"), walked)
+        self.assertIn(os.path.join(self.root, "x", "three.bin"), walked)
+
+    def test_empty_directory_makes_trees_differ(self):
+        os.makedirs(os.path.join(self.root, "y", "docs", "empty"))
+        reported = self.scan().find_duplicate_directories()
+        self.assertEqual(reported, [[os.path.join(self.root, "x", "docs", "deep"),
+                                     os.path.join(self.root, "y", "docs", "deep")]])
+
+    def test_equal_digests_are_not_trusted_without_the_bytes(self):
+        original = os.path.join(self.root, "x", "docs", "one.txt")
+        impostor = self.write("y/docs/one.txt", b"uno\n")  # Same size and name, other bytes
+        finder = self.scan()
+        finder.file_hashes[impostor] = finder.file_hashes[original] = "0" * 32  # As if MD5 collided
+
+        reported = finder.find_duplicate_directories()
+        self.assertEqual(reported, [[os.path.join(self.root, "x", "docs", "deep"),
+                                     os.path.join(self.root, "y", "docs", "deep")]])
+        self.assertIn(impostor, self.walked(finder))
+
+    def test_refused_with_min_size(self):
+        finder = self.scan(min_size=10)
+        self.assertEqual(finder.find_duplicate_directories(), [])
+        self.assertIn(os.path.join(self.root, "y", "three.bin"), self.walked(finder))
+
+
+if __name__ == "__main__":
+    unittest.main()
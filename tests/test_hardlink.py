@@ -0,0 +1,84 @@
+import contextlib
+import io
+import os
+import unittest
+from unittest import mock
+
+from support import CONTENT, TreeTestCase
+
+from ccdupe_6 import rollback_journal
+
+"""
+Hardlink cleanup must either link every duplicate or leave the tree as it was.
+"""
+
+
+class HardlinkTest(TreeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.journal = os.path.join(self.tmp.name, "link.journal")
+        self.inodes = {path: os.stat(path).st_ino for path in [self.keeper] + self.duplicates}
+
+    def assertUntouched(self):
+        for path, inode in self.inodes.items():
+            self.assertEqual(os.stat(path).st_ino, inode)
+            self.assertEqual(self.read(path), CONTENT)
+        leftovers = [name for _, _, files in os.walk(self.root) for name in files if ".ccdupe-" in name]
+        self.assertEqual(leftovers, [])
+        self.assertFalse(os.path.exists(self.journal))
+
+    def test_links_every_duplicate(self):
+        finder, plan = self.find()
+        finder.hardlink_duplicates(plan, self.journal)
+
+        keeper_inode = os.stat(self.keeper).st_ino
+        for path in self.duplicates:
+            self.assertEqual(os.stat(path).st_ino, keeper_inode)
+        self.assertFalse(os.path.exists(self.journal))
+
+    def test_duplicates_linked_to_each_other_free_their_inode(self):
+        os.remove(self.duplicates[1])
+        os.link(self.duplicates[0], self.duplicates[1])
+        finder, plan = self.find()
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            finder.hardlink_duplicates(plan, self.journal)
+        self.assertIn(f"freeing {len(CONTENT)} bytes", out.getvalue())
+
+    def test_failed_prepare_rolls_back(self):
+        finder, plan = self.find()
+        # A stale temporary link makes os.link() fail for the second duplicate
+        folder, name = os.path.split(self.duplicates[1])
+        with open(os.path.join(folder, f".{name}.{os.getpid()}.ccdupe-tmp"), "wb"):
+            pass
+
+        finder.hardlink_duplicates(plan, self.journal)
+        self.assertUntouched()
+
+    def test_interrupted_batch_rolls_back_from_journal(self):
+        finder, plan = self.find()
+        # Interrupted after every swap, before the backups are removed
+        with mock.patch("os.remove", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                finder.hardlink_duplicates(plan, self.journal)
+        self.assertTrue(os.path.exists(self.journal))
+        self.assertEqual(os.stat(self.duplicates[0]).st_ino, self.inodes[self.keeper])
+
+        rollback_journal(self.journal)
+        self.assertUntouched()
+
+    def test_refuses_to_overwrite_a_journal(self):
+        finder, plan = self.find()
+        with open(self.journal, "w") as f:
+            f.write("left by a crashed run\n")
+
+        finder.hardlink_duplicates(plan, self.journal)
+        with open(self.journal) as f:
+            self.assertEqual(f.read(), "left by a crashed run\n")
+        os.remove(self.journal)
+        self.assertUntouched()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import unittest
+
+from support import CONTENT, TreeTestCase
+
+"""
+Keep rules pick the file each cluster keeps, and a cleanup must never remove the only real copy.
+"""
+
+
+class KeepRuleTest(TreeTestCase):
+    def setUp(self):
+        super().setUp()
+        # keep.bin oldest, copy2.bin newest
+        for age, path in enumerate(reversed([self.keeper] + self.duplicates)):
+            os.utime(path, ns=(0, (1_000_000 - age) * 1_000_000_000))
+
+    def keep(self, *rules):
+        (keeper, duplicates), = self.finder().plan_cleanup(list(rules))
+        self.assertNotIn(keeper, duplicates)
+        return keeper
+
+    def test_oldest_and_newest(self):
+        self.assertEqual(self.keep("oldest"), self.keeper)
+        self.assertEqual(self.keep("newest"), self.duplicates[1])
+
+    def test_shortest_path(self):
+        short = self.write("d.bin", CONTENT)
+        self.assertEqual(self.keep("shortest-path"), short)
+
+    def test_root_then_tie_break(self):
+        self.assertEqual(self.keep(f"root:{os.path.join(self.root, 'c')}"), self.duplicates[1])
+        self.assertEqual(self.keep(f"root:{self.root}", "newest"), self.duplicates[1])
+
+    def test_regex_without_the_command_line(self):
+        self.assertEqual(self.keep("regex:copy1"), self.duplicates[0])
+        self.assertEqual(self.keep("regex:nothing matches", "oldest"), self.keeper)
+
+
+class SymlinkTest(TreeTestCase):
+    def test_symlink_is_not_a_duplicate_of_its_target(self):
+        link = os.path.join(self.root, "l")
+        os.symlink(self.keeper, link)
+
+        finder = self.finder()
+        self.assertNotIn(link, finder.file_stats)
+        plan = finder.plan_cleanup(["shortest-path"])
+        finder.cleanup(plan)
+        self.assertEqual(self.read(link), CONTENT)
+
+    def test_cleanup_skips_a_keeper_replaced_by_a_symlink(self):
+        finder, plan = self.find()
+        os.rename(self.keeper, self.keeper + ".moved")
+        os.symlink(self.keeper + ".moved", self.keeper)
+        os.remove(self.keeper + ".moved")  # The kept path now dangles
+
+        finder.cleanup(plan)
+        for path in self.duplicates:
+            self.assertEqual(self.read(path), CONTENT)
+
+    def test_cleanup_skips_the_keeper_under_another_name(self):
+        finder, plan = self.find()
+        os.remove(self.duplicates[0])
+        os.link(self.keeper, self.duplicates[0])
+
+        finder.cleanup(plan)
+        self.assertEqual(self.read(self.keeper), CONTENT)
+        self.assertTrue(os.path.exists(self.duplicates[0]))
+        self.assertFalse(os.path.exists(self.duplicates[1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import unittest
+
+from support import CONTENT, TreeTestCase
+
+from ccdupe_6 import apply_plan
+
+"""
+A saved plan is re-verified twice: when it is written and when it is applied. A file that changed
+after it was verified must never be touched.
+"""
+
+
+class PlanTest(TreeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.plan_file = os.path.join(self.tmp.name, "plan.json.gz")
+        self.options = {"workers": 2, "link": None, "journal_file": None, "quarantine_dir": None}
+
+    def test_apply_deletes_verified_duplicates(self):
+        finder, plan = self.find()
+        finder.write_plan(plan, self.plan_file)
+
+        apply_plan(self.plan_file, self.options)
+        self.assertEqual(self.read(self.keeper), CONTENT)
+        for path in self.duplicates:
+            self.assertFalse(os.path.exists(path))
+
+    def test_apply_skips_a_file_changed_after_the_plan(self):
+        finder, plan = self.find()
+        finder.write_plan(plan, self.plan_file)
+        changed, unchanged = self.duplicates
+        self.change(changed)
+        expected = self.read(changed)
+
+        apply_plan(self.plan_file, self.options)
+        self.assertEqual(self.read(changed), expected)
+        self.assertFalse(os.path.exists(unchanged))
+        self.assertTrue(os.path.exists(self.keeper))
+
+    def test_apply_skips_a_cluster_whose_keeper_changed(self):
+        finder, plan = self.find()
+        finder.write_plan(plan, self.plan_file)
+        self.change(self.keeper)
+
+        apply_plan(self.plan_file, self.options)
+        for path in self.duplicates:
+            self.assertEqual(self.read(path), CONTENT)
+
+    def test_write_leaves_out_a_file_changed_after_verification(self):
+        finder, plan = self.find()
+        changed, unchanged = self.duplicates
+        self.change(changed)
+        finder.write_plan(plan, self.plan_file)
+        expected = self.read(changed)
+
+        apply_plan(self.plan_file, self.options)
+        self.assertEqual(self.read(changed), expected)
+        self.assertFalse(os.path.exists(unchanged))
+
+
+if __name__ == "__main__":
+    unittest.main()
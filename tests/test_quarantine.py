@@ -0,0 +1,82 @@
+import os
+import unittest
+
+from support import CONTENT, TreeTestCase
+
+from ccdupe_6 import DuplicateFileFinder, purge_quarantine, quarantined_files, undo_quarantine
+
+"""
+Quarantined files can always be restored until they are purged, and the quarantine itself is never
+scanned as part of the tree.
+"""
+
+
+class QuarantineTest(TreeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.quarantine = os.path.join(self.tmp.name, "quarantine")
+
+    def test_undo_restores_every_file(self):
+        finder, plan = self.find()
+        finder.quarantine_duplicates(plan, self.quarantine)
+        for path in self.duplicates:
+            self.assertFalse(os.path.exists(path))
+        self.assertEqual(len(quarantined_files(self.quarantine)), 2)
+
+        undo_quarantine(self.quarantine)
+        for path in self.duplicates:
+            self.assertEqual(self.read(path), CONTENT)
+        self.assertEqual(quarantined_files(self.quarantine), [])
+
+        undo_quarantine(self.quarantine)  # Nothing left to restore
+        self.assertEqual(quarantined_files(self.quarantine), [])
+
+    def test_undo_never_overwrites_a_new_file(self):
+        finder, plan = self.find()
+        finder.quarantine_duplicates(plan, self.quarantine)
+        self.write("b/copy1.bin", b"new file")
+
+        undo_quarantine(self.quarantine)
+        self.assertEqual(self.read(self.duplicates[0]), b"new file")
+        self.assertEqual(self.read(self.duplicates[1]), CONTENT)
+        self.assertEqual(len(quarantined_files(self.quarantine)), 1)
+
+    def test_purge_keeps_files_younger_than_the_retention(self):
+        finder, plan = self.find()
+        finder.quarantine_duplicates(plan, self.quarantine)
+
+        purge_quarantine(self.quarantine, 30)
+        self.assertEqual(len(quarantined_files(self.quarantine)), 2)
+
+    def test_purge_then_undo_restores_nothing(self):
+        finder, plan = self.find()
+        finder.quarantine_duplicates(plan, self.quarantine)
+
+        purge_quarantine(self.quarantine, 0)
+        self.assertEqual(quarantined_files(self.quarantine), [])
+        self.assertEqual(sorted(os.listdir(self.quarantine)), [".ccdupe-quarantine", "journal.ndjson"])
+
+        undo_quarantine(self.quarantine)
+        for path in self.duplicates:
+            self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.read(self.keeper), CONTENT)
+
+    def test_quarantine_is_not_scanned_again(self):
+        finder, plan = self.find()
+        self.quarantine = os.path.join(self.root, "quarantine")  # Inside the scanned tree
+        finder.quarantine_duplicates(plan, self.quarantine)
+
+        rescan = DuplicateFileFinder(self.root)
+        rescan.scan_directory()
+        self.assertNotIn(self.quarantine, {os.path.dirname(path) for path in rescan.file_stats})
+
+    def test_application_journal_does_not_hide_a_directory(self):
+        copy = self.write("logs/copy3.bin", CONTENT)
+        self.write("logs/journal.ndjson", b'{"event": "start"}\n')
+
+        finder = self.finder()
+        self.assertIn(copy, finder.verified_clusters[0][2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import errno
+import threading
+import time
+import unittest
+
+from support import TreeTestCase
+
+from ccdupe_6 import DuplicateFileFinder, ReadExecutor
+
+"""
+ReadExecutor retries transient errors and gives up on a read only when it stops making progress;
+the finder defers such files and retries them once at the end.
+"""
+
+
+class Flaky:
+    """ Fails with the given errno a number of times, then returns "ok". """
+
+    def __init__(self, failures, code=errno.EIO):
+        self.failures = failures
+        self.code = code
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise OSError(self.code, "flaky")
+        return "ok"
+
+
+class RetryTest(unittest.TestCase):
+    def test_transient_error_is_retried(self):
+        read = Flaky(2)
+        self.assertEqual(ReadExecutor(retries=3, backoff=0).run(read), "ok")
+        self.assertEqual(read.calls, 3)
+
+    def test_retries_run_out(self):
+        read = Flaky(5)
+        with self.assertRaises(OSError):
+            ReadExecutor(retries=2, backoff=0).run(read)
+        self.assertEqual(read.calls, 3)
+
+    def test_other_errors_are_not_retried(self):
+        read = Flaky(1, errno.ENOENT)
+        with self.assertRaises(FileNotFoundError):
+            ReadExecutor(retries=3, backoff=0).run(read)
+        self.assertEqual(read.calls, 1)
+
+
+class DeadlineTest(unittest.TestCase):
+    def test_slow_read_that_makes_progress_finishes(self):
+        reader = ReadExecutor(timeout=0.05)
+
+        def slow():
+            for _ in range(10):
+                time.sleep(0.02)
+                reader.beat()
+            return "done"
+
+        self.assertEqual(reader.run(slow), "done")
+        self.assertEqual(reader.abandoned, 0)
+
+    def test_stalled_read_is_abandoned_and_stops(self):
+        reader = ReadExecutor(timeout=0.05)
+        release = threading.Event()
+        outcome = []
+
+        def stalled():
+            release.wait()  # Stuck in the kernel, say
+            try:
+                reader.beat()
+                outcome.append("went on")
+            except OSError as e:
+                outcome.append(e.errno)
+
+        started = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            reader.run(stalled)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(reader.abandoned, 1)
+
+        self.assertEqual(reader.run(lambda: "fresh worker"), "fresh worker")
+        release.set()
+        for _ in range(100):
+            if outcome:
+                break
+            time.sleep(0.01)
+        self.assertEqual(outcome, [errno.ECANCELED])  # The abandoned read stopped at its next chunk
+
+    def test_timeout_is_not_retried(self):
+        reader = ReadExecutor(timeout=0.02, retries=3, backoff=0)
+        calls = []
+        with self.assertRaises(TimeoutError):
+            reader.run(lambda: calls.append(1) or time.sleep(0.2))
+        self.assertEqual(len(calls), 1)
+
+
+class SlowFinder(DuplicateFileFinder):
+    """ The first full read of one file hangs past the deadline. """
+
+    def __init__(self, directory, slow=None, **kwargs):
+        super().__init__(directory, reader=ReadExecutor(timeout=0.05), **kwargs)
+        self.slow = slow
+
+    def _read_hash(self, file_path):
+        if file_path == self.slow:
+            self.slow = None
+            time.sleep(0.3)
+        return super()._read_hash(file_path)
+
+
+class DeferTest(TreeTestCase):
+    def test_timed_out_file_is_retried_at_the_end(self):
+        finder = SlowFinder(self.root, slow=self.duplicates[0])
+        finder.scan_directory()
+        finder.find_true_duplicates()
+
+        self.assertEqual(finder.deferred, [])
+        self.assertEqual([sorted(files) for _, _, files in finder.verified_clusters],
+                         [sorted([self.keeper] + self.duplicates)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import io
+import json
+import os
+import unittest
+
+from support import CONTENT, TreeTestCase
+
+from ccdupe_6 import DuplicateFileFinder, ResultWriter
+
+"""
+Streamed results must add up: a cluster that stops holding is withdrawn before its new version.
+"""
+
+
+class StreamTest(TreeTestCase):
+    def stream(self, output_format="ndjson"):
+        out = io.StringIO()
+        writer = ResultWriter(output_format, out)
+        finder = DuplicateFileFinder(self.root, result_writer=writer)
+        finder.scan_directory()
+        finder.find_true_duplicates()
+        return finder, writer, out
+
+    def records(self, writer, out):
+        writer.close()
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def join_group(self, finder, path):
+        """ Rewrites a walked file into one more copy, as if it changed while being read. """
+        with open(path, "wb") as f:
+            f.write(CONTENT)
+        st = os.stat(path)
+        finder.changed[path] = (st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+        finder._requeue_changed()
+
+    def test_each_cluster_once(self):
+        finder, writer, out = self.stream()
+        records = self.records(writer, out)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(sorted(records[0]["paths"]), sorted([self.keeper] + self.duplicates))
+        self.assertEqual(records[0]["reclaimable_bytes"], 2 * len(CONTENT))
+
+    def test_reopened_cluster_is_withdrawn_first(self):
+        finder, writer, out = self.stream()
+        self.join_group(finder, self.other)
+
+        first, withdrawn, replaced = self.records(writer, out)
+        self.assertTrue(withdrawn["withdrawn"])
+        self.assertEqual(withdrawn["paths"], first["paths"])
+        self.assertEqual(sorted(replaced["paths"]), sorted([self.keeper, self.other] + self.duplicates))
+        total = sum(record["reclaimable_bytes"] for record in (first, withdrawn, replaced))
+        self.assertEqual(total, 3 * len(CONTENT))
+
+    def test_csv_marks_withdrawals(self):
+        finder, writer, out = self.stream("csv")
+        self.join_group(finder, self.other)
+        writer.close()
+
+        rows = out.getvalue().splitlines()
+        self.assertEqual(rows[0], "cluster,size,digest,reclaimable_bytes,withdrawn,path")
+        self.assertEqual([row.split(",")[4] for row in rows[1:]], ["0"] * 3 + ["1"] * 3 + ["0"] * 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import contextlib
+import errno
+import io
+import json
+import os
+import socket
+import unittest
+from unittest import mock
+
+from support import CONTENT, TreeTestCase
+
+from ccdupe_6 import DuplicateFileFinder
+
+"""
+--serve answers every lookup with a JSON line: matches, or an error when the file cannot be read.
+"""
+
+
+class LookupTest(TreeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.finder = DuplicateFileFinder(self.root)
+        self.finder.scan_directory()
+        self.finder._index_digests()
+
+    def lookup(self, request):
+        return json.loads(self.finder.lookup(request.encode()))
+
+    def test_path_of_a_copy(self):
+        outside = os.path.join(self.tmp.name, "new.bin")
+        with open(outside, "wb") as f:
+            f.write(CONTENT)
+
+        reply = self.lookup(f"PATH {outside}")
+        self.assertTrue(reply["duplicate"])
+        self.assertEqual(sorted(reply["matches"]), sorted([self.keeper] + self.duplicates))
+
+        reply = self.lookup(f"PATH {self.keeper}")
+        self.assertEqual(sorted(reply["matches"]), sorted(self.duplicates))
+
+    def test_digest(self):
+        digest = self.finder.file_hashes[self.other]
+        reply = self.lookup(f"DIGEST {os.path.getsize(self.other)} {digest.upper()}")
+        self.assertEqual(reply, {"duplicate": True, "matches": [self.other]})
+
+    def test_unreadable_path_is_an_error(self):
+        self.assertIn("error", self.lookup(f"PATH {os.path.join(self.root, 'missing')}"))
+        self.assertIn("error", self.lookup(f"PATH {os.path.join(self.root, 'a')}"))
+
+        out = io.StringIO()
+        with mock.patch.object(self.finder, "_read_hash", side_effect=OSError(errno.EACCES, "Permission denied")), \
+                contextlib.redirect_stdout(out):
+            reply = self.lookup(f"PATH {self.keeper}")
+        self.assertEqual(reply, {"error": "[Errno 13] Permission denied"})
+        self.assertEqual(out.getvalue(), "")
+
+
+class SocketTest(TreeTestCase):
+    def test_claims_only_stale_sockets(self):
+        finder = DuplicateFileFinder(self.root)
+        path = os.path.join(self.tmp.name, "lookup.sock")
+
+        with open(path, "w"):
+            pass
+        self.assertFalse(finder._claim_socket(path))
+        self.assertTrue(os.path.exists(path))
+        os.remove(path)
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen()
+        self.assertFalse(finder._claim_socket(path))  # A live daemon
+        listener.close()
+
+        self.assertTrue(finder._claim_socket(path))  # Left behind by it
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == "__main__":
+    unittest.main()